@@ -0,0 +1,290 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+# Headless benchmark suite for both simulators. Every run (one simulator,
+# scenario, size and engine/particle count) happens in a fresh subprocess so
+# peak memory is per run and the two simulators' flat imports don't clash.
+# Results are written as JSON so runs can be diffed against each other.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = (
+    "sand_column",
+    "water_pool",
+    "lava_meets_water",
+    "full_grid",
+    "sparse_grid",
+)
+
+
+def setup_new(spec):
+    import numpy as np
+    from simulation import Simulation
+    from materials import Sand, Water, Lava, CELL
+
+    size = spec["size"]
+    simulation = Simulation(
+        size, size, engine=spec["engine"], seed=0, in_place=spec["in_place"]
+    )
+    grid = simulation.grid
+    scenario = spec["scenario"]
+    if scenario == "sand_column":
+        grid[: size // 2, 2 * size // 5 : 3 * size // 5] = CELL[Sand.id]
+    elif scenario == "water_pool":
+        grid[size // 2 :] = CELL[Water.id]
+    elif scenario == "lava_meets_water":
+        grid[: size // 3] = CELL[Lava.id]
+        grid[2 * size // 3 :] = CELL[Water.id]
+    elif scenario == "full_grid":
+        grid[:] = CELL[Sand.id]
+        grid[::2] = CELL[Water.id]
+    elif scenario == "sparse_grid":
+        rng = np.random.default_rng(0)
+        grid[rng.random(grid.shape) < 0.02] = CELL[Sand.id]
+    simulation.reindex()
+
+    def step():
+        simulation.step()
+
+    def particles():
+        return simulation.population()
+
+    render = None
+    if spec["render"]:
+        import pygame
+        from render import Renderer
+
+        pygame.init()
+        window = pygame.display.set_mode((800, 800))
+        renderer = Renderer(window, simulation)
+
+        def render():
+            renderer.draw()
+            pygame.display.flip()
+
+    return step, particles, render, simulation.close
+
+
+def setup_old(spec):
+    import random
+    import pygame
+    from simulation import Simulation
+
+    random.seed(0)
+    pygame.init()
+    size = spec["size"]
+    window = pygame.display.set_mode((size, size))
+    simulation = Simulation(window, size, size, seed=0)
+
+    count = spec["particles"]
+    scenario = spec["scenario"]
+    margin = 30
+    span = size - 2 * margin
+
+    def anywhere():
+        return random.uniform(margin, size - margin)
+
+    if scenario == "sand_column":
+        layout = [
+            ("Sand", size / 2 + random.uniform(-span / 10, span / 10), anywhere())
+            for _ in range(count)
+        ]
+    elif scenario == "water_pool":
+        layout = [
+            ("Water", anywhere(), size - margin - random.uniform(0, span / 2))
+            for _ in range(count)
+        ]
+    elif scenario == "lava_meets_water":
+        layout = [
+            ("Lava", anywhere(), margin + random.uniform(0, span / 3))
+            for _ in range(count // 2)
+        ] + [
+            ("Water", anywhere(), size - margin - random.uniform(0, span / 3))
+            for _ in range(count - count // 2)
+        ]
+    elif scenario == "full_grid":
+        names = ("Sand", "Water", "Gravel")
+        layout = [(names[i % 3], anywhere(), anywhere()) for i in range(count)]
+    elif scenario == "sparse_grid":
+        layout = [("Sand", anywhere(), anywhere()) for _ in range(max(1, count // 10))]
+
+    for name, x, y in layout:
+        material = simulation.material_classes[name]
+        particle = material.create_particle(simulation.space, x, y)
+        simulation.particles.add(particle)
+
+    def step():
+        simulation.update()
+        simulation.step()
+
+    def particles():
+        return len(simulation.particles)
+
+    render = None
+    if spec["render"]:
+
+        def render():
+            simulation.draw()
+            pygame.display.flip()
+
+    return step, particles, render, None
+
+
+def run(spec):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    sys.path.insert(0, os.path.join(ROOT, spec["sim"]))
+    setup = setup_new if spec["sim"] == "new" else setup_old
+    step, particles, render, close = setup(spec)
+
+    for _ in range(spec["warmup"]):
+        step()
+
+    times = []
+    start = time.perf_counter()
+    while len(times) < spec["frames"]:
+        frame_start = time.perf_counter()
+        step()
+        if render:
+            render()
+        times.append(time.perf_counter() - frame_start)
+        if time.perf_counter() - start > spec["time_limit"]:
+            break
+
+    if close:
+        close()
+
+    times.sort()
+    total = sum(times)
+    steps_per_sec = len(times) / total
+    count = particles()
+    # Spec fields identify the run; the live count at the end gets its own key
+    result = dict(spec)
+    result.update(
+        frames_run=len(times),
+        final_particles=count,
+        steps_per_sec=steps_per_sec,
+        particle_updates_per_sec=count * steps_per_sec,
+        p50_ms=times[len(times) // 2] * 1000,
+        p99_ms=times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / (1024 * 1024 if sys.platform == "darwin" else 1024),
+    )
+    if spec["sim"] == "new":
+        result["cells_per_sec"] = spec["size"] ** 2 * steps_per_sec
+    return result
+
+
+def specs(args):
+    common = dict(
+        frames=args.frames,
+        warmup=args.warmup,
+        time_limit=args.time_limit,
+        render=args.render,
+    )
+    for sim in args.sims:
+        if sim == "new":
+            combos = itertools.product(args.scenarios, args.sizes, args.engines)
+            for scenario, size, engine in combos:
+                yield dict(
+                    common,
+                    sim=sim,
+                    scenario=scenario,
+                    size=size,
+                    engine=engine,
+                    in_place=args.in_place and engine == "cell",
+                )
+        else:
+            combos = itertools.product(args.scenarios, args.particles)
+            for scenario, particles in combos:
+                yield dict(
+                    common,
+                    sim=sim,
+                    scenario=scenario,
+                    size=args.window,
+                    particles=particles,
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless simulator benchmarks")
+    parser.add_argument(
+        "--sims", nargs="+", default=["new", "old"], choices=["new", "old"]
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 256, 512])
+    parser.add_argument(
+        "--engines", nargs="+", default=["cell", "vectorized", "margolus"]
+    )
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="step the cell engine in place instead of into a copy",
+    )
+    parser.add_argument("--particles", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--window", type=int, default=600, help="old sim window size")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=10.0,
+        help="seconds per run before stopping early",
+    )
+    parser.add_argument(
+        "--render", action="store_true", help="include rendering in each frame"
+    )
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(json.loads(args.run))))
+        return
+
+    results = []
+    for spec in specs(args):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", json.dumps(spec)],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(f"failed: {spec}\n{proc.stderr}", file=sys.stderr)
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        label = result.get("engine", result.get("particles"))
+        if result.get("in_place"):
+            label = f"{label}/inplace"
+        print(
+            f"{result['sim']:>3} {result['scenario']:<16} size={result['size']:<5} "
+            f"{label!s:<12} "
+            f"{result['steps_per_sec']:9.1f} steps/s  p99 {result['p99_ms']:8.2f} ms",
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import multiprocessing
+import queue
+import numpy as np
+from materials import get_material, Air, N_MATERIALS
+from simulation import Simulation
+from timestep import FixedTimestep
+from metrics import Metrics
+from cell import CELL_DTYPE, empty
+
+# Steps a Simulation in a worker process so the main process only has to
+# draw. After every batch of steps the worker copies its grid into whichever
+# of two shared buffers is not the most recently published one, then
+# publishes it. Each buffer has a version counter that is odd while the
+# worker is writing it, so a reader can take a consistent copy without
+# locks by retrying whenever the version moved under it. Brush strokes go
+# the other way through a queue the worker drains before each step. The
+# worker's own phase timings and counters come back through a queue with
+# room for one report; what doesn't fit yet goes into the next one.
+
+
+def _run(
+    width,
+    height,
+    engine,
+    seed,
+    in_place,
+    sim_rate,
+    buffers,
+    versions,
+    latest,
+    rate,
+    counts,
+    strokes,
+    reports,
+    stop,
+):
+    simulation = Simulation(
+        width, height, engine=engine, seed=seed, in_place=in_place
+    )
+    grids = [
+        np.frombuffer(buffer, dtype=CELL_DTYPE).reshape(height, width)
+        for buffer in buffers
+    ]
+    timestep = FixedTimestep(sim_rate, sim_rate)
+    metrics = simulation.metrics
+    # Recorded but not yet handed to the main process
+    times, tallies = {}, {}
+    try:
+        while not stop.is_set():
+            while True:
+                try:
+                    points, material_id, radius, mode = strokes.get_nowait()
+                except queue.Empty:
+                    break
+                simulation.paint(points, get_material(material_id), radius, mode)
+
+            steps = timestep.advance()
+            metrics.begin_frame()
+            for _ in range(steps):
+                simulation.step()
+            metrics.end_frame()
+            rate.value = timestep.achieved_sim_rate
+            if not steps:
+                timestep.wait()
+                continue
+
+            back = 1 - latest.value
+            versions[back] += 1
+            grids[back][:] = simulation.grid
+            versions[back] += 1
+            latest.value = back
+            # May run a batch ahead of the published grid for a moment
+            counts[:] = simulation.occupancy.counts
+
+            _add(times, metrics.times)
+            _add(tallies, metrics.counts)
+            try:
+                reports.put_nowait((times, tallies))
+                times, tallies = {}, {}
+            except queue.Full:
+                pass
+    finally:
+        simulation.close()
+
+
+def _add(totals, values):
+    for name, value in values.items():
+        totals[name] = totals.get(name, 0) + value
+
+
+class BackgroundSimulation:
+    def __init__(
+        self, width, height, engine="cell", seed=None, sim_rate=60, in_place=False
+    ):
+        # The worker is a daemon, which cannot start the tiled engine's pool
+        if engine == "tiled":
+            raise ValueError("The tiled engine has its own workers, use Simulation")
+        self.width = width
+        self.height = height
+        self.engine = engine
+        # Only sees this process; the worker steps with metrics of its own
+        self.metrics = Metrics()
+        context = multiprocessing.get_context()
+        # "H" is the ctypes twin of the uint16 cells
+        buffers = [context.RawArray("H", width * height) for _ in range(2)]
+        self._grids = [
+            np.frombuffer(buffer, dtype=CELL_DTYPE).reshape(height, width)
+            for buffer in buffers
+        ]
+        self._versions = context.RawArray("q", 2)
+        self._latest = context.RawValue("i", 0)
+        self._rate = context.RawValue("d", 0.0)
+        self._counts = context.RawArray("q", N_MATERIALS)
+        self._strokes = context.Queue()
+        self._reports = context.Queue(1)
+        self._stop = context.Event()
+        # Snapshot handed to the renderer
+        self._front = empty((height, width))
+        self._process = context.Process(
+            target=_run,
+            args=(
+                width,
+                height,
+                engine,
+                seed,
+                in_place,
+                sim_rate,
+                buffers,
+                self._versions,
+                self._latest,
+                self._rate,
+                self._counts,
+                self._strokes,
+                self._reports,
+                self._stop,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+
+    def _check_worker(self):
+        # A dead worker would otherwise leave the last grid up forever
+        if self._process.exitcode is not None and not self._stop.is_set():
+            raise RuntimeError(
+                f"Simulation worker exited with code {self._process.exitcode}"
+            )
+
+    @property
+    def grid(self):
+        # Copy of the most recently completed grid
+        while True:
+            self._check_worker()
+            latest = self._latest.value
+            version = self._versions[latest]
+            if version % 2:
+                continue  # Published buffer is being rewritten, look again
+            np.copyto(self._front, self._grids[latest])
+            if self._versions[latest] == version:
+                return self._front
+
+    @property
+    def achieved_sim_rate(self):
+        return self._rate.value
+
+    def population(self, material=None):
+        # As of the worker's last published batch
+        if material is None:
+            return sum(self._counts) - self._counts[Air.id]
+        return self._counts[material.id]
+
+    def add_material(self, x, y, material, radius):
+        self.paint([(x, y)], material, radius)
+
+    def paint(self, points, material, radius, mode="paint"):
+        self._check_worker()
+        with self.metrics.phase("brush"):
+            self._strokes.put((list(points), material.id, radius, mode))
+
+    def collect(self):
+        # Fold the worker's step timings and counters since the last call
+        # into this process's metrics frame
+        try:
+            while True:
+                self.metrics.merge(*self._reports.get_nowait())
+        except queue.Empty:
+            pass
+
+    def step(self):
+        # The worker steps on its own clock
+        pass
+
+    def close(self):
+        self._stop.set()
+        self._process.join()
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import time
+import numpy as np
+from simulation import Simulation
+from materials import Air, Sand, Water, CELL, get_material
+from cell import MATERIAL
+from frame_random import FrameRandom
+
+
+def make_simulation(size, engine, workers=None):
+    simulation = Simulation(size, size, engine=engine, seed=0, workers=workers)
+    # Alternating rows of sand and water keep every cell busy
+    simulation.grid[:] = CELL[Sand.id]
+    simulation.grid[::2] = CELL[Water.id]
+    simulation.reindex()
+    return simulation
+
+
+async def gather_update(simulation):
+    # The old per-cell path: one task per particle through the async
+    # Material.update wrapper, gathered row by row
+    grid = simulation.grid
+    new_grid = grid.copy()
+    rand = FrameRandom(simulation.rng, grid.shape)
+    for y in range(simulation.height - 1, -1, -1):
+        non_air_indices = np.where(grid[y] != Air.id)[0]
+        await asyncio.gather(
+            *[
+                get_material(grid[y, x] & MATERIAL).update(
+                    grid, x, y, new_grid, rand
+                )
+                for x in non_air_indices
+            ]
+        )
+    simulation.grid = new_grid
+
+
+def time_frames(step, frames):
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame simulation cost")
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--engine", default="cell")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        help="worker counts to compare with the tiled engine",
+    )
+    args = parser.parse_args()
+
+    if args.engine == "tiled":
+        scale_workers(args.size, args.frames, args.workers or [1, 2, 4, 8])
+        return
+
+    results = {}
+    if args.engine == "cell":
+        gather_sim = make_simulation(args.size, args.engine)
+        results["asyncio.gather per cell"] = time_frames(
+            lambda: asyncio.run(gather_update(gather_sim)), args.frames
+        )
+
+    # What main.py used to do: a fresh event loop for every frame
+    async_sim = make_simulation(args.size, args.engine)
+    results["asyncio.run(update())"] = time_frames(
+        lambda: asyncio.run(async_sim.update()), args.frames
+    )
+
+    sync_sim = make_simulation(args.size, args.engine)
+    results["step()"] = time_frames(sync_sim.step, args.frames)
+
+    print(f"{args.engine} engine, {args.size}x{args.size} grid, {args.frames} frames")
+    step_ms = np.median(results["step()"]) * 1000
+    for name, times in results.items():
+        ms = np.median(times) * 1000
+        print(f"{name:<25} {ms:8.2f} ms/frame  (step() saves {ms - step_ms:.2f})")
+
+
+def scale_workers(size, frames, worker_counts):
+    print(f"tiled engine, {size}x{size} grid, {frames} frames")
+    base = None
+    for workers in worker_counts:
+        simulation = make_simulation(size, "tiled", workers)
+        simulation.step()  # Warm up the worker processes
+        times = time_frames(simulation.step, frames)
+        simulation.close()
+
+        cells_per_second = size * size / np.median(times)
+        base = base or cells_per_second
+        print(
+            f"{workers:>2} workers  {np.median(times) * 1000:8.2f} ms/frame  "
+            f"{cells_per_second / 1e6:7.2f} Mcells/s  x{cells_per_second / base:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
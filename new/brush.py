@@ -0,0 +1,62 @@
+import numpy as np
+from functools import lru_cache
+from materials import Air, CELL
+
+# "paint" overwrites everything under the brush, "replace" only fills Air
+# and "erase" turns the brush area back into Air
+MODES = ("paint", "replace", "erase")
+
+
+@lru_cache(maxsize=None)
+def disk_offsets(radius):
+    # (dy, dx) offsets of every cell within radius of the brush centre
+    y_range, x_range = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+    dy, dx = np.nonzero(x_range * x_range + y_range * y_range <= radius * radius)
+    dy -= radius
+    dx -= radius
+    dy.flags.writeable = False
+    dx.flags.writeable = False
+    return dy, dx
+
+
+def stroke_points(points, spacing=1.0):
+    # Fill in a polyline of (x, y) samples so consecutive brush centres are
+    # at most spacing cells apart
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) == 1:
+        return np.rint(points).astype(np.intp)
+
+    segments = np.diff(points, axis=0)
+    lengths = np.abs(segments).max(axis=1) / spacing
+    steps = np.maximum(np.ceil(lengths).astype(np.intp), 1)
+    segment = np.repeat(np.arange(len(segments)), steps)
+    starts = np.repeat(np.cumsum(steps) - steps, steps)
+    t = (np.arange(steps.sum()) - starts) / steps[segment]
+    filled = points[segment] + segments[segment] * t[:, None]
+    return np.rint(np.vstack([filled, points[-1:]])).astype(np.intp)
+
+
+def stamp(grid, points, material_id, radius, mode="paint"):
+    # Stamp the brush along the whole stroke in one go and return the
+    # (ys, xs) of the distinct cells that were written and what they held
+    if mode not in MODES:
+        raise ValueError(f"Unknown brush mode {mode!r}, expected one of {MODES}")
+    height, width = grid.shape
+    # Overlapping disks half a radius apart still leave no gaps
+    centres = stroke_points(points, max(1.0, radius / 2))
+    dy, dx = disk_offsets(radius)
+
+    ys = (centres[:, 1, None] + dy).ravel()
+    xs = (centres[:, 0, None] + dx).ravel()
+    inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+    # Neighbouring disks overlap, count each cell once
+    ys, xs = np.divmod(np.unique(ys[inside] * width + xs[inside]), width)
+    before = grid[ys, xs]
+
+    if mode == "replace":
+        empty = before == Air.id
+        ys, xs, before = ys[empty], xs[empty], before[empty]
+
+    # Painted cells start out as a fresh cell of the material
+    grid[ys, xs] = Air.id if mode == "erase" else CELL[material_id]
+    return ys, xs, before
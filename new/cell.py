@@ -0,0 +1,41 @@
+import numpy as np
+
+# Packed cell format. Every cell of a grid is one uint16 holding everything
+# about the particle in it, so per-particle state travels with the particle
+# when cells are moved or swapped and a step reads and writes a single array:
+#
+#   bits  0-3   material id
+#   bits  4-11  unused, always zero
+#   bits 12-15  flags, scratch space of the step being taken and zero between
+#               steps. The whole-grid engines set MOVED on particles that
+#               moved or reacted; the per-cell engine stepping in place
+#               stamps the cells it writes (see materials.remember).
+#
+# An empty cell is Air with every other field zero, i.e. exactly 0, so
+# comparing whole cells against Air's id is still a valid emptiness test
+# between steps. The accessors below work on whole arrays as well as single
+# cells and take an optional out array so per-frame callers can reuse their
+# buffers.
+
+CELL_DTYPE = np.uint16
+
+MATERIAL_BITS = 4
+MATERIAL = (1 << MATERIAL_BITS) - 1  # Mask of the material id
+
+FLAGS_SHIFT = 12
+
+FLAGS = 0xF << FLAGS_SHIFT  # Mask of the flags
+STATE = (1 << FLAGS_SHIFT) - 1  # Mask of everything a particle carries
+MOVED = CELL_DTYPE(1 << FLAGS_SHIFT)  # Typed so a mask times it is cells
+
+
+def empty(shape):
+    return np.zeros(shape, dtype=CELL_DTYPE)
+
+
+def material(cells, out=None):
+    return np.bitwise_and(cells, MATERIAL, out=out)
+
+
+def flags(cells):
+    return cells >> FLAGS_SHIFT
@@ -0,0 +1,59 @@
+import numpy as np
+
+CHUNK_SIZE = 16
+# Frames a chunk has to stay unchanged before it is put to sleep. Viscous
+# fluids only move on a fraction of frames, so this can't be too short.
+SLEEP_FRAMES = 30
+
+
+class ChunkTracker:
+    # Splits the grid into square chunks and counts how many frames each has
+    # gone without a change. A change in a chunk wakes it and its eight
+    # neighbours, since material can flow across the edge on the next frame.
+    def __init__(self, width, height, size=CHUNK_SIZE, sleep_frames=SLEEP_FRAMES):
+        self.width = width
+        self.height = height
+        self.size = size
+        self.sleep_frames = sleep_frames
+        self.idle = np.zeros((-(-height // size), -(-width // size)), dtype=np.int32)
+
+    def awake_at(self, ys, xs):
+        # Whether the chunk of each given cell is awake
+        return self.idle[ys // self.size, xs // self.size] < self.sleep_frames
+
+    def update(self, ys, xs):
+        # ys, xs are the cells the last step changed
+        self.age()
+        self.mark(ys, xs)
+
+    def age(self):
+        # Once per step, before marking what changed in it
+        self.idle += 1
+
+    def mark(self, ys, xs):
+        # Wake the chunk of every changed cell and the eight around it
+        if not len(ys):
+            return
+        rows, cols = self.idle.shape
+        chunks = np.unique(ys // self.size * cols + xs // self.size)
+        cy, cx = np.divmod(chunks, cols)
+        around = np.arange(-1, 2)
+        self.idle[
+            np.clip(cy[:, None, None] + around[:, None], 0, rows - 1),
+            np.clip(cx[:, None, None] + around, 0, cols - 1),
+        ] = 0
+
+    def wake_all(self):
+        self.idle[:] = 0
+
+    def sleep_all(self):
+        self.idle[:] = self.sleep_frames
+
+    def wake(self, x0, y0, x1, y1):
+        # Wake every chunk touching the inclusive cell rectangle, plus a ring
+        # of neighbours around it
+        size = self.size
+        self.idle[
+            max(0, y0 // size - 1) : y1 // size + 2,
+            max(0, x0 // size - 1) : x1 // size + 2,
+        ] = 0
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class FrameRandom:
+    # Random numbers for one tick of the per-cell engine, drawn from the
+    # simulation's Generator as whole (H, W) planes instead of one global
+    # np.random call per decision. A cell reads its own entry of a plane, so
+    # every decision a cell makes in a tick has its own independent draw and
+    # the result only depends on the generator's seed. Planes are drawn the
+    # first time they are used in a tick, so ticks where every chunk is
+    # asleep draw nothing. One FrameRandom can be kept for every tick by
+    # calling next_tick() between them; planes are then redrawn into the
+    # arrays they already have instead of new ones, and only over the rows
+    # the tick's cells are in.
+    def __init__(self, rng, shape):
+        self.rng = rng
+        self.shape = shape
+        self._bands = [(0, shape[0])]
+        self._planes = {}
+        self._buffers = {}
+
+    def next_tick(self, bands=None):
+        # bands are the (y0, y1) row ranges whose cells read their entries
+        # this tick, every row when not given
+        self._bands = [(0, self.shape[0])] if bands is None else bands
+        self._planes.clear()
+
+    def _plane(self, name, finish=None):
+        plane = self._planes.get(name)
+        if plane is None:
+            plane = self._buffers.get(name)
+            if plane is None:
+                plane = self._buffers[name] = np.empty(self.shape)
+            for y0, y1 in self._bands:
+                rows = plane[y0:y1]
+                self.rng.random(out=rows)
+                if finish:
+                    finish(rows)
+            self._planes[name] = plane
+        return plane
+
+    @property
+    def drift(self):
+        # Sideways step while falling, -1, 0 or 1
+        return self._plane("drift", _drift)
+
+    @property
+    def diagonal(self):
+        # Which diagonal to try first, true (1.0) for left
+        return self._plane("diagonal", _coin)
+
+    @property
+    def spread(self):
+        # Whether a fluid spreads this tick, compared against its viscosity
+        return self._plane("spread")
+
+    @property
+    def distance(self):
+        # Scaled by the maximum spread distance of the cell
+        return self._plane("distance")
+
+    @property
+    def side(self):
+        # Which side a fluid tries to spread to first, true (1.0) for left
+        return self._plane("side", _coin)
+
+    @property
+    def chance(self):
+        # Reaction rolls and other one-off probabilities
+        return self._plane("chance")
+
+
+# Planes are all floats so they can be drawn in place; these turn a uniform
+# plane into the values a property hands out without a second array
+def _drift(plane):
+    plane *= 3
+    np.floor(plane, out=plane)
+    plane -= 1
+
+
+def _coin(plane):
+    np.less(plane, 0.5, out=plane)
@@ -1,12 +1,19 @@
 import pygame
 from simulation import Simulation
 from render import Renderer
-from materials import Sand, Water, Lava, Steam, Stone, Mud
-import asyncio
-import cProfile
+from timestep import FixedTimestep
+from background import BackgroundSimulation
+from materials import Sand, Water, Lava, Steam, Stone, Mud, get_material
 
 # Add this constant at the top of the file
 GRID_SIZE = 100  # Increase this value for a larger grid
+ENGINE = "cell"  # or "vectorized"/"margolus" to step the whole grid with NumPy
+IN_PLACE = False  # Cell engine updates the grid, not a copy; pays off on big grids
+SIM_RATE = 60  # Simulation steps per second
+RENDER_RATE = 60  # Target frames per second, dropped first when the sim is slow
+BACKGROUND = False  # Step the sim in a worker process while this one draws; not tiled
+METRICS_SAMPLE_EVERY = 1  # Record phase timings every Nth frame, 0 to turn off
+METRICS_EXPORT = None  # e.g. "metrics.csv" or "metrics.json", written on quit
 
 
 # Add this new class for the GUI
@@ -32,10 +39,19 @@ def main():
 
     pygame.display.set_caption("Powder Sim")
 
-    simulation = Simulation(width, height)
+    in_place = IN_PLACE and ENGINE == "cell"
+    if BACKGROUND:
+        simulation = BackgroundSimulation(
+            width, height, engine=ENGINE, sim_rate=SIM_RATE, in_place=in_place
+        )
+    else:
+        simulation = Simulation(width, height, engine=ENGINE, in_place=in_place)
     renderer = Renderer(window, simulation)
+    metrics = simulation.metrics
+    metrics.sample_every = METRICS_SAMPLE_EVERY
+    show_metrics = False  # Toggled with F3
 
-    clock = pygame.time.Clock()
+    timestep = FixedTimestep(SIM_RATE, RENDER_RATE)
     running = True
 
     brush_size = 1
@@ -47,60 +63,122 @@ def main():
         color = renderer.colors[material.id]
         buttons.append(MaterialButton(10, 10 + i * 50, 100, 40, material, color))
 
-    selected_material = Sand()
+    selected_material = get_material(Sand.id)
     font = pygame.font.Font(None, 36)
+    overlay_font = pygame.font.Font(None, 24)
 
-    # Set up profiler
-    profiler = cProfile.Profile()
-    profiler.enable()
+    def to_grid(pos):
+        x, y = pos
+        return (
+            x * simulation.width // window.get_width(),
+            y * simulation.height // window.get_height(),
+        )
 
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-                profiler.disable()
-                profiler.print_stats(sort="time")
-                profiler.dump_stats("profile.pstats")
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = pygame.mouse.get_pos()
-                for button in buttons:
-                    if button.rect.collidepoint(x, y):
-                        selected_material = button.material()
-                        break
-            # If the left bracket is pressed, decrease brush size
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_DOWN:
-                    print(brush_size)
-                    brush_size = max(1, brush_size - 1)
-                elif event.key == pygame.K_UP:
-                    print(brush_size)
-                    brush_size = min(10, brush_size + 1)
-            elif pygame.mouse.get_pressed()[0]:
-                x, y = pygame.mouse.get_pos()
-                grid_x = int(x * simulation.width // window.get_width())
-                grid_y = int(y * simulation.height // window.get_height())
-                simulation.add_material(grid_x, grid_y, selected_material, brush_size)
-
-        asyncio.run(simulation.update())
-        asyncio.run(renderer.render())
-
-        # Draw material buttons
-        for button in buttons:
-            button.draw(window)
-
-        # Highlight selected material
-        for button in buttons:
-            if isinstance(selected_material, button.material):
-                pygame.draw.rect(window, (255, 255, 0), button.rect, 3)
-
-        # Render material selector text
-        selector_text = f"Selected: {selected_material.__class__.__name__}"
-        text_surface = font.render(selector_text, True, (255, 255, 255))
-        window.blit(text_surface, (120, 10))
-
-        pygame.display.flip()
-        clock.tick(60)
+    # Last brush position of the stroke in progress, in grid cells
+    last_sample = None
 
+    metrics.begin_frame()
+    while running:
+        with metrics.phase("input"):
+            # Mouse samples of the current stroke seen this frame
+            stroke = []
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    x, y = pygame.mouse.get_pos()
+                    for button in buttons:
+                        if button.rect.collidepoint(x, y):
+                            selected_material = get_material(button.material.id)
+                            break
+                # If the left bracket is pressed, decrease brush size
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_DOWN:
+                        print(brush_size)
+                        brush_size = max(1, brush_size - 1)
+                    elif event.key == pygame.K_UP:
+                        print(brush_size)
+                        brush_size = min(10, brush_size + 1)
+                    elif event.key == pygame.K_F3:
+                        show_metrics = not show_metrics
+                elif event.type == pygame.MOUSEMOTION and (
+                    event.buttons[0] or event.buttons[2]
+                ):
+                    stroke.append(to_grid(event.pos))
+
+            # Left button paints, right button erases, holding shift only fills Air
+            pressed = pygame.mouse.get_pressed()
+            pos = pygame.mouse.get_pos()
+            painting = (pressed[0] or pressed[2]) and not any(
+                button.rect.collidepoint(pos) for button in buttons
+            )
+        if painting:
+            if last_sample is not None:
+                stroke.insert(0, last_sample)
+            stroke.append(to_grid(pos))
+            if pressed[2]:
+                mode = "erase"
+            elif pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                mode = "replace"
+            else:
+                mode = "paint"
+            simulation.paint(stroke, selected_material, brush_size, mode)
+            last_sample = stroke[-1]
+        else:
+            last_sample = None
+
+        if BACKGROUND:
+            # The worker keeps its own time, this loop only paces rendering
+            timestep.advance()
+            timestep.achieved_sim_rate = simulation.achieved_sim_rate
+            simulation.collect()
+        else:
+            for _ in range(timestep.advance()):
+                simulation.step()
+
+        if not timestep.render_due():
+            timestep.wait()
+            continue
+
+        with metrics.phase("render"):
+            renderer.draw()
+
+            # Draw material buttons
+            for button in buttons:
+                button.draw(window)
+
+            # Highlight selected material
+            for button in buttons:
+                if isinstance(selected_material, button.material):
+                    pygame.draw.rect(window, (255, 255, 0), button.rect, 3)
+
+            # Render material selector text
+            selector_text = (
+                f"Selected: {selected_material.__class__.__name__} "
+                f"({simulation.population(selected_material)})"
+            )
+            text_surface = font.render(selector_text, True, (255, 255, 255))
+            window.blit(text_surface, (120, 10))
+
+            # Achieved simulation and render rates, then the metrics overlay
+            lines = [timestep.overlay_text()]
+            if show_metrics:
+                lines += metrics.overlay_lines()
+            y = 10
+            for line in lines:
+                text = overlay_font.render(line, True, (255, 255, 255))
+                window.blit(text, (window.get_width() - text.get_width() - 10, y))
+                y += text.get_height()
+
+        with metrics.phase("flip"):
+            pygame.display.flip()
+        # A frame runs from one flip to the next, idle passes included
+        metrics.end_frame()
+        metrics.begin_frame()
+
+    if METRICS_EXPORT:
+        metrics.export(METRICS_EXPORT)
+    simulation.close()
     pygame.quit()
 
 
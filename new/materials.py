@@ -2,7 +2,7 @@ from abc import ABC, abstractmethod
 import numpy as np
 from copy import deepcopy
 import math
-import asyncio
+from cell import CELL_DTYPE, MATERIAL, FLAGS, FLAGS_SHIFT, STATE
 
 GRAVITY = 1.0
 
@@ -10,18 +10,49 @@ GRAVITY = 1.0
 class Material(ABC):
     id = None
     density = 0.1
+    direction = 0  # 1 falls, -1 rises, 0 stays put
+
+    def __setattr__(self, name, value):
+        # Instances are shared between every cell holding the material
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
 
     @abstractmethod
-    async def update(self, grid, x, y, new_grid):
+    def step(self, grid, x, y, new_grid, rand, in_place=False):
+        # Grids hold packed cells (see cell.py); mask with MATERIAL to get
+        # the material id. rand is the tick's FrameRandom; read the entries
+        # at (y, x). When stepping in place new_grid is grid and the cells
+        # written this tick are stamped (see remember)
         pass
 
+    async def update(self, grid, x, y, new_grid, rand, in_place=False):
+        self.step(grid, x, y, new_grid, rand, in_place)
+
     def react(self, other_material):
-        # Default behavior: no reaction
-        return self
+        # Looks up the reaction table, returning self when nothing happens or
+        # (what other_material becomes, what self becomes) when it does
+        if REACTION_PROBABILITY[self.id, other_material.id] == 0:
+            return self
+        return (
+            get_material(REACTION_TARGET[self.id, other_material.id]),
+            get_material(REACTION_SOURCE[self.id, other_material.id]),
+        )
 
-    def end_of_life(self, grid, x, y):
-        # Default behavior: turn into Air
-        grid[y, x] = Air.id
+    def try_react(self, new_grid, x, y, target_x, target_y, rand, in_place=False):
+        other = new_grid[target_y, target_x] & MATERIAL
+        if not reacts(self.id, other, rand.chance[y, x]):
+            return False
+        REACTION_TALLY[self.id, other] += 1
+        if in_place:
+            remember(new_grid, target_x, target_y)
+        # Whatever reacts starts over as a fresh cell of what it becomes
+        put(new_grid, target_x, target_y, CELL[REACTION_TARGET[self.id, other]])
+        put(new_grid, x, y, CELL[REACTION_SOURCE[self.id, other]])
+        return True
+
+    def end_of_life(self, grid, x, y, roll, in_place=False):
+        # Default behavior: turn into Air. Only ever called on a particle's
+        # own cell, which is stamped already when stepping in place.
+        grid[y, x] &= FLAGS
 
     def copy(self):
         return deepcopy(self)
@@ -31,7 +62,7 @@ class Air(Material):
     id = 0
     density = 0.1
 
-    def update(self, grid, x, y, new_grid):
+    def step(self, grid, x, y, new_grid, rand, in_place=False):
         pass
 
 
@@ -39,36 +70,29 @@ class Particle(Material):
     friction = 0.5
     elasticity = 0.5
     mass = 1.0
+    direction = 1
 
-    async def update(self, grid, x, y, new_grid):
+    def step(self, grid, x, y, new_grid, rand, in_place=False):
         height, width = grid.shape
         if y < height - 1:
-            fall_speed, dx = await self.calculate_fall(grid, x, y)
+            fall_speed, dx = self.calculate_fall(grid, x, y, rand)
             target_y = min(y + fall_speed, height - 1)
             target_x = max(0, min(x + dx, width - 1))
 
-            if new_grid[target_y, target_x] == Air.id:
-                self.move(new_grid, x, y, target_x, target_y)
-            else:
-                other_material = get_material(new_grid[target_y, target_x])
-                reaction_result = self.react(other_material)
-                if isinstance(reaction_result, tuple):
-                    # Handle the case where two materials are produced
-                    new_grid[target_y, target_x] = reaction_result[0].id
-                    new_grid[y, x] = reaction_result[1].id
-                elif reaction_result.id != self.id:
-                    new_grid[target_y, target_x] = reaction_result.id
-                    new_grid[y, x] = Air.id
-                elif other_material.density < self.density and issubclass(
-                    other_material.__class__, Fluid
-                ):
-                    self.displace(new_grid, x, y, target_x, target_y)
+            other = new_grid[target_y, target_x] & MATERIAL
+            if other == Air.id:
+                self.move(new_grid, x, y, target_x, target_y, in_place)
+            elif not self.try_react(new_grid, x, y, target_x, target_y, rand, in_place):
+                if SINKS[self.id, other]:
+                    self.displace(new_grid, x, y, target_x, target_y, in_place)
                 else:
-                    self.try_move_diagonally(new_grid, x, y, width, height)
+                    self.try_move_diagonally(
+                        new_grid, x, y, width, height, rand, in_place
+                    )
 
-    async def calculate_fall(self, grid, x, y):
-        dx = np.random.randint(-1, 2)
-        surrounding_density = await self.get_density_below(grid, x, y)
+    def calculate_fall(self, grid, x, y, rand):
+        dx = int(rand.drift[y, x])
+        surrounding_density = self.get_density_below(grid, x, y)
 
         if self.density <= surrounding_density:
             return 1, 0  # Particle floats or sits on top
@@ -80,33 +104,22 @@ class Particle(Material):
 
         return fall_speed, dx
 
-    async def get_density_below(self, grid, x, y):
+    def get_density_below(self, grid, x, y):
         height, width = grid.shape
-
-        valid_cells = [
-            (y + 1, x),
-            (y + 1, x + 1),
-            (y + 1, x - 1),
-        ]
-
-        async def get_particle_density(ny, nx):
-            particle = await self._get_valid_particle(grid, ny, nx)
-            return particle.density if particle else None
-
-        densities = await asyncio.gather(
-            *[get_particle_density(ny, nx) for ny, nx in valid_cells]
-        )
-        valid_densities = [d for d in densities if d is not None]
-
-        if not valid_densities:
+        if y + 1 >= height:
             return 1000  # Floor
 
-        return sum(valid_densities) / len(valid_densities)
+        row = grid[y + 1]
+        total = DENSITY[row[x] & MATERIAL]
+        count = 1
+        if x + 1 < width:
+            total += DENSITY[row[x + 1] & MATERIAL]
+            count += 1
+        if x > 0:
+            total += DENSITY[row[x - 1] & MATERIAL]
+            count += 1
 
-    async def _get_valid_particle(self, grid, ny, nx):
-        if ny >= 0 and ny < grid.shape[0] and nx >= 0 and nx < grid.shape[1]:
-            return get_material(grid[ny, nx])
-        return None
+        return total / count
 
     def get_surrounding_materials(self, grid, x, y):
         height, width = grid.shape
@@ -128,30 +141,40 @@ class Particle(Material):
             & (surrounding_cells[:, 1] >= 0)
             & (surrounding_cells[:, 1] < width)
         ]
-        return [get_material(grid[ny, nx]) for ny, nx in valid_cells]
-
-    def move(self, new_grid, from_x, from_y, to_x, to_y):
-        new_grid[to_y, to_x] = self.id
-        new_grid[from_y, from_x] = Air.id
-
-    def displace(self, new_grid, from_x, from_y, to_x, to_y):
-        displaced_material = new_grid[to_y, to_x]
-        new_grid[to_y, to_x] = self.id
-        new_grid[from_y, from_x] = displaced_material
-
-    def try_move_diagonally(self, new_grid, x, y, width, height):
-        directions = np.array([(y + 1, x - 1), (y + 1, x + 1)])
-        np.random.shuffle(directions)
+        return [get_material(grid[ny, nx] & MATERIAL) for ny, nx in valid_cells]
+
+    def move(self, new_grid, from_x, from_y, to_x, to_y, in_place=False):
+        # from is always the cell being stepped, so only to needs stamping,
+        # and it only ever moves into Air (see remember). Everything packed
+        # into the cell goes along, its flags stay behind.
+        TALLY["moves"] += 1
+        stamp = new_grid[to_y, to_x] & FLAGS
+        if in_place and not stamp:
+            stamp = (Air.id + 1) << FLAGS_SHIFT
+        new_grid[to_y, to_x] = stamp | new_grid[from_y, from_x] & STATE
+        new_grid[from_y, from_x] &= FLAGS
+
+    def displace(self, new_grid, from_x, from_y, to_x, to_y, in_place=False):
+        TALLY["displacements"] += 1
+        if in_place:
+            remember(new_grid, to_x, to_y)
+        displaced = new_grid[to_y, to_x] & STATE
+        put(new_grid, to_x, to_y, new_grid[from_y, from_x] & STATE)
+        put(new_grid, from_x, from_y, displaced)
+
+    def try_move_diagonally(self, new_grid, x, y, width, height, rand, in_place=False):
+        if rand.diagonal[y, x]:
+            directions = ((y + 1, x - 1), (y + 1, x + 1))
+        else:
+            directions = ((y + 1, x + 1), (y + 1, x - 1))
         for ny, nx in directions:
             if 0 <= nx < width and 0 <= ny < height:
-                target = new_grid[ny, nx]
+                target = new_grid[ny, nx] & MATERIAL
                 if target == Air.id:
-                    self.move(new_grid, x, y, nx, ny)
+                    self.move(new_grid, x, y, nx, ny, in_place)
                     break
-                elif get_material(target).density < self.density and issubclass(
-                    get_material(target).__class__, Fluid
-                ):
-                    self.displace(new_grid, x, y, nx, ny)
+                elif SINKS[self.id, target]:
+                    self.displace(new_grid, x, y, nx, ny, in_place)
                     break
 
 
@@ -162,39 +185,37 @@ class Powder(Particle):
 class Fluid(Particle):
     viscosity = 0.5
 
-    async def update(self, grid, x, y, new_grid):
-        await super().update(grid, x, y, new_grid)
-        if new_grid[y, x] == self.id:  # If the particle hasn't moved vertically
-            await self.spread_horizontally(grid, new_grid, x, y)
+    def step(self, grid, x, y, new_grid, rand, in_place=False):
+        super().step(grid, x, y, new_grid, rand, in_place)
+        # If the particle hasn't moved vertically
+        if new_grid[y, x] & MATERIAL == self.id:
+            self.spread_horizontally(grid, new_grid, x, y, rand, in_place)
 
-    async def spread_horizontally(self, grid, new_grid, x, y):
-        if np.random.random() > self.viscosity:
+    def spread_horizontally(self, grid, new_grid, x, y, rand, in_place=False):
+        if rand.spread[y, x] > self.viscosity:
             height, width = grid.shape
-            surrounding_density = await self.get_density_below(grid, x, y)
-            spread_distance = np.random.randint(
+            surrounding_density = self.get_density_below(grid, x, y)
+            max_distance = max(
                 1,
-                max(
-                    1,
-                    int(
-                        (self.density / surrounding_density)
-                        * (1 - self.viscosity)
-                        * GRAVITY
-                    ),
-                )
-                + 1,
+                int(
+                    (self.density / surrounding_density)
+                    * (1 - self.viscosity)
+                    * GRAVITY
+                ),
             )
+            spread_distance = 1 + int(rand.distance[y, x] * max_distance)
 
-            directions = np.array([-1, 1])
-            np.random.shuffle(directions)
+            directions = (-1, 1) if rand.side[y, x] else (1, -1)
 
             for direction in directions:
                 target_x = x + direction * spread_distance
                 if 0 <= target_x < width:
-                    if new_grid[y, target_x] == Air.id:
-                        self.move(new_grid, x, y, target_x, y)
+                    target = new_grid[y, target_x] & MATERIAL
+                    if target == Air.id:
+                        self.move(new_grid, x, y, target_x, y, in_place)
                         break
-                    elif get_material(new_grid[y, target_x]).density < self.density:
-                        self.displace(new_grid, x, y, target_x, y)
+                    elif DENSITY[target] < self.density:
+                        self.displace(new_grid, x, y, target_x, y, in_place)
                     break
 
 
@@ -205,13 +226,6 @@ class Sand(Powder):
     elasticity = 0.3
     mass = 1.5
 
-    def react(self, other_material):
-        if isinstance(other_material, Lava):
-            return Stone()
-        elif isinstance(other_material, Water):
-            return Mud()
-        return self
-
 
 class Water(Fluid):
     id = 2
@@ -219,59 +233,46 @@ class Water(Fluid):
     viscosity = 0.3
     mass = 1.0
 
-    def react(self, other_material):
-        if isinstance(other_material, Lava):
-            return (Stone(), Steam())
-        return self
-
 
 class Steam(Fluid):
     id = 3
     density = 0.5
+    direction = -1
     viscosity = 0.1
     mass = 0.5
 
-    async def update(self, grid, x, y, new_grid):
+    def step(self, grid, x, y, new_grid, rand, in_place=False):
         # Steam rises
         height, width = grid.shape
         if y > 0:
-            fall_speed, dx = await self.calculate_fall(grid, x, y)
+            fall_speed, dx = self.calculate_fall(grid, x, y, rand)
             target_y = max(y - fall_speed, 0)
             target_x = max(0, min(x + dx, width - 1))
 
-            if new_grid[target_y, target_x] == Air.id:
-                self.move(new_grid, x, y, target_x, target_y)
-            else:
-                other_material = get_material(new_grid[target_y, target_x])
-                reaction_result = self.react(other_material)
-                if isinstance(reaction_result, tuple):
-                    # Handle the case where two materials are produced
-                    new_grid[target_y, target_x] = reaction_result[0].id
-                    new_grid[y, x] = reaction_result[1].id
-                elif reaction_result.id != self.id:
-                    new_grid[target_y, target_x] = reaction_result.id
-                    new_grid[y, x] = Air.id
-                elif other_material.density > self.density:
-                    self.displace(new_grid, x, y, target_x, target_y)
+            other = new_grid[target_y, target_x] & MATERIAL
+            if other == Air.id:
+                self.move(new_grid, x, y, target_x, target_y, in_place)
+            elif not self.try_react(new_grid, x, y, target_x, target_y, rand, in_place):
+                if DENSITY[other] > self.density:
+                    self.displace(new_grid, x, y, target_x, target_y, in_place)
                 else:
-                    self.try_move_diagonally(new_grid, x, y, width, height)
+                    self.try_move_diagonally(
+                        new_grid, x, y, width, height, rand, in_place
+                    )
         else:
-            if np.random.random() < 0.5:
-                self.try_move_diagonally(new_grid, x, y, width, height)
+            roll = rand.chance[y, x]
+            if roll < 0.5:
+                self.try_move_diagonally(new_grid, x, y, width, height, rand, in_place)
             else:
-                self.end_of_life(new_grid, x, y)
+                # The upper half of the roll is itself a uniform roll
+                self.end_of_life(new_grid, x, y, (roll - 0.5) * 2, in_place)
 
-    def react(self, other_material):
-        if isinstance(other_material, Water):
-            return Water()  # Steam condenses back to water
-        return self
-
-    def end_of_life(self, grid, x, y):
+    def end_of_life(self, grid, x, y, roll, in_place=False):
         # 20% chance to turn into Water, 80% chance to disappear
-        if np.random.random() < 0.2:
-            grid[y, x] = Water.id
+        if roll < 0.2:
+            put(grid, x, y, CELL[Water.id])
         else:
-            grid[y, x] = Air.id
+            grid[y, x] &= FLAGS
 
 
 class Lava(Fluid):
@@ -280,13 +281,6 @@ class Lava(Fluid):
     viscosity = 0.5
     mass = 2.0
 
-    def react(self, other_material):
-        if isinstance(other_material, Water):
-            return (Stone(), Steam())
-        elif isinstance(other_material, Stone):
-            return (Lava(), Steam())
-        return self
-
 
 class Stone(Powder):
     id = 5
@@ -295,11 +289,6 @@ class Stone(Powder):
     elasticity = 0.1
     mass = 2.5
 
-    def react(self, other_material):
-        if isinstance(other_material, Lava):
-            return (Lava(), Stone())
-        return self
-
 
 class Mud(Fluid):
     id = 6
@@ -319,7 +308,90 @@ MATERIALS = {
     Mud.id: Mud,
 }
 
+# One shared instance per material, handed out for every cell
+MATERIAL_INSTANCES = {id: cls() for id, cls in MATERIALS.items()}
+
+# Material properties indexed by id, for code that works on whole grids or
+# doesn't need the material object itself
+N_MATERIALS = max(MATERIALS) + 1
+if N_MATERIALS > MATERIAL + 1:
+    raise ValueError("More materials than the packed cell format has ids for")
+# Stepping in place stamps cells with 1 + a material id in their flags
+if N_MATERIALS > FLAGS >> FLAGS_SHIFT:
+    raise ValueError("More materials than the stamps in the flags can tell apart")
+DENSITY = np.zeros(N_MATERIALS)
+VISCOSITY = np.ones(N_MATERIALS)
+IS_FLUID = np.zeros(N_MATERIALS, dtype=bool)
+DIRECTION = np.zeros(N_MATERIALS, dtype=np.int8)
+
+for material_id, material in MATERIALS.items():
+    DENSITY[material_id] = material.density
+    DIRECTION[material_id] = material.direction
+    IS_FLUID[material_id] = issubclass(material, Fluid)
+    if IS_FLUID[material_id]:
+        VISCOSITY[material_id] = material.viscosity
+
+# Whether a falling material sinks into another it lands on, indexed by
+# (material id, other id): fluids lighter than it, unless rests_on says not
+SINKS = IS_FLUID[None, :] & (DENSITY[None, :] < DENSITY[:, None])
+
+# The packed cell a material starts out as, e.g. when painted or made by a
+# reaction: its id with every other field zero, so Air's is 0.
+CELL = np.arange(N_MATERIALS, dtype=CELL_DTYPE)
+
+# Reactions between a moving material and the material it runs into, indexed
+# by (material id, other id): the other cell becomes REACTION_TARGET and the
+# moving cell becomes REACTION_SOURCE with REACTION_PROBABILITY per contact
+REACTION_PROBABILITY = np.zeros((N_MATERIALS, N_MATERIALS))
+REACTION_TARGET = np.zeros((N_MATERIALS, N_MATERIALS), dtype=np.int8)
+REACTION_SOURCE = np.zeros((N_MATERIALS, N_MATERIALS), dtype=np.int8)
+
+# Running totals bumped by the update rules of every engine. The simulation
+# moves them into its metrics and zeroes them after each step.
+TALLY = {"cells": 0, "moves": 0, "displacements": 0}
+REACTION_TALLY = np.zeros((N_MATERIALS, N_MATERIALS), dtype=np.int64)
+
+
+def register_reaction(material, other, target, source=Air, probability=1.0):
+    REACTION_PROBABILITY[material.id, other.id] = probability
+    REACTION_TARGET[material.id, other.id] = target.id
+    REACTION_SOURCE[material.id, other.id] = source.id
+
+
+def rests_on(material, other):
+    SINKS[material.id, other.id] = False
+
+
+def reacts(material_id, other_id, roll):
+    # roll is a uniform draw in [0, 1)
+    probability = REACTION_PROBABILITY[material_id, other_id]
+    return probability >= 1 or roll < probability
+
+
+def remember(grid, x, y):
+    # Stepping in place, the flags of a cell are 0 until something writes it
+    # this tick and from then on 1 + the material it held before the tick.
+    # A stamped cell isn't stepped again in the same tick, so nothing moves
+    # twice, and the stamps tell what changed (see Occupancy.apply_stamps).
+    cell = grid[y, x]
+    if cell <= STATE:
+        grid[y, x] = cell | ((cell & MATERIAL) + 1) << FLAGS_SHIFT
+
+
+def put(grid, x, y, cell):
+    # Writes a cell without flags, keeping the flags already there
+    grid[y, x] = grid[y, x] & FLAGS | cell
+
+
+register_reaction(Sand, Lava, Stone)
+register_reaction(Sand, Water, Mud)
+register_reaction(Water, Lava, Stone, Steam)
+register_reaction(Steam, Water, Water)  # Steam condenses back to water
+register_reaction(Lava, Water, Stone, Steam)
+register_reaction(Lava, Stone, Lava, Steam)
+rests_on(Stone, Lava)
+
 
-# Function to get a new instance of a material
+# Function to get the shared instance of a material
 def get_material(id):
-    return MATERIALS[id]()
+    return MATERIAL_INSTANCES[id]
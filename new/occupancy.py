@@ -0,0 +1,90 @@
+import numpy as np
+from materials import Air, N_MATERIALS
+from cell import STATE, flags, material
+
+
+class Occupancy:
+    # Population of every material plus the occupied (non-Air) cells of a
+    # grid, kept up to date from the cells that change instead of rescanning
+    # the grid. Occupied cells are held as a sorted array of keys that put
+    # them in the order the per-cell engine visits them: bottom row first,
+    # left to right within a row. Only the per-cell engine visits cells, so
+    # the keys are only built once cells() is first called; engines that
+    # step the whole grid just keep the counts.
+    def __init__(self, grid):
+        self.height, self.width = grid.shape
+        self.rebuild(grid)
+
+    def rebuild(self, grid, counts=None):
+        # Full rescan, for when the grid was written to without telling us.
+        # counts are the population of grid when it is already known.
+        if counts is None:
+            counts = np.bincount(material(grid.ravel()), minlength=N_MATERIALS)
+        self.counts = counts
+        self.keys = None
+
+    def __len__(self):
+        return int(self.counts.sum() - self.counts[Air.id])
+
+    def count(self, material_id):
+        return int(self.counts[material_id])
+
+    def cells(self, grid):
+        # (ys, xs) of every occupied cell of grid in visiting order
+        if self.keys is None:
+            ys, xs = np.nonzero(grid[::-1] != Air.id)
+            self.keys = ys * self.width + xs
+        rows, xs = np.divmod(self.keys, self.width)
+        return self.height - 1 - rows, xs
+
+    def update(self, ys, xs, before, after):
+        # The distinct cells at (ys, xs) went from holding before to after,
+        # packed cells or bare material ids
+        self.counts -= np.bincount(material(before), minlength=N_MATERIALS)
+        self.counts += np.bincount(material(after), minlength=N_MATERIALS)
+        if self.keys is None:
+            return
+
+        keys = (self.height - 1 - ys) * self.width + xs
+        emptied = np.sort(keys[(before != Air.id) & (after == Air.id)])
+        filled = np.sort(keys[(before == Air.id) & (after != Air.id)])
+        if len(emptied):
+            self.keys = np.delete(self.keys, np.searchsorted(self.keys, emptied))
+        if len(filled):
+            self.keys = np.insert(
+                self.keys, np.searchsorted(self.keys, filled), filled
+            )
+
+    def apply(self, old_grid, new_grid):
+        # Takes in one step's changes and returns (ys, xs) of the changed cells
+        ys, xs = np.nonzero(old_grid != new_grid)
+        self.update(ys, xs, old_grid[ys, xs], new_grid[ys, xs])
+        return ys, xs
+
+    def apply_stamps(self, grid, bands):
+        # Same for a step made in place, from the stamps it left in the cells
+        # (see materials.remember), which are cleared for the next step. Only
+        # the (y0, y1) row ranges in bands are looked at.
+        found = [np.nonzero(grid[y0:y1] > STATE) for y0, y1 in bands]
+        ys = np.concatenate([rows + y0 for (rows, _), (y0, _) in zip(found, bands)])
+        xs = np.concatenate([xs for _, xs in found])
+        cells = grid[ys, xs]
+        before = flags(cells).astype(np.int8) - 1
+        grid[ys, xs] = cells & STATE
+        after = material(cells)
+        changed = before != after
+        ys, xs = ys[changed], xs[changed]
+        self.update(ys, xs, before[changed], after[changed])
+        return ys, xs
+
+
+def row_bands(ys, margin=0):
+    # (y0, y1) row ranges covering every row in ys and margin rows on either
+    # side, merged where they touch
+    rows = np.unique(ys)
+    if not len(rows):
+        return []
+    gaps = np.nonzero(np.diff(rows) > 2 * margin + 1)[0]
+    starts = rows[np.r_[0, gaps + 1]] - margin
+    ends = rows[np.r_[gaps, len(rows) - 1]] + margin + 1
+    return list(zip(np.maximum(starts, 0).tolist(), ends.tolist()))
@@ -1,13 +1,23 @@
 import pygame
-import asyncio
 import numpy as np
 from materials import Air, Sand, Water, Steam, Lava, Stone, Mud
+from cell import MATERIAL, empty, material
+
+
+# "array" maps the whole grid through a palette and blits it in one go,
+# "cells" draws a rect per particle
+RENDER_PATHS = ("array", "cells")
 
 
 class Renderer:
-    def __init__(self, window, simulation):
+    def __init__(self, window, simulation, path="array"):
+        if path not in RENDER_PATHS:
+            raise ValueError(
+                f"Unknown render path {path!r}, expected one of {RENDER_PATHS}"
+            )
         self.window = window
         self.simulation = simulation
+        self.path = path
         # Calculate pixel size based on window and grid sizes
         self.pixel_size = min(
             window.get_width() // simulation.width,
@@ -23,7 +33,37 @@ class Renderer:
             Mud.id: (60, 60, 50),
         }
 
+        # RGB colour per material id
+        self.palette = np.zeros((MATERIAL + 1, 3), dtype=np.uint8)
+        for material_id, color in self.colors.items():
+            self.palette[material_id] = color[:3]
+
+        # Persistent grid-sized surface, the (x, y, rgb) buffer behind it and
+        # the material ids of the frame being drawn
+        self.grid_surface = pygame.Surface((simulation.width, simulation.height))
+        self.pixels = np.zeros(
+            (simulation.width, simulation.height, 3), dtype=np.uint8
+        )
+        self.ids = empty((simulation.height, simulation.width))
+
+    def draw(self):
+        if self.path == "array":
+            self._draw_array()
+        else:
+            self._draw_cells()
+
     async def render(self):
+        self.draw()
+
+    def _draw_array(self):
+        # Air is black in the palette, so the whole window gets overwritten
+        ids = material(self.simulation.grid, out=self.ids)
+        np.take(self.palette, ids.T, axis=0, out=self.pixels)
+        pygame.surfarray.blit_array(self.grid_surface, self.pixels)
+        # Nearest-neighbour scale straight into the window
+        pygame.transform.scale(self.grid_surface, self.window.get_size(), self.window)
+
+    def _draw_cells(self):
         # Fill the window with black
         self.window.fill((0, 0, 0))
 
@@ -35,23 +75,18 @@ class Renderer:
             pygame.SRCALPHA,  # Add this flag to support transparency
         )
 
-        await self._render_rows(surface)
+        for y in range(self.simulation.height):
+            self._render_row(y, surface)
 
         self.window.blit(
             pygame.transform.scale(surface, self.window.get_size()), (0, 0)
         )
 
-    async def _render_rows(self, surface):
-        tasks = []
-        for y in range(self.simulation.height):
-            tasks.append(self._render_row(y, surface))
-        await asyncio.gather(*tasks)
-
-    async def _render_row(self, y, surface):
-        row = self.simulation.grid[y]
+    def _render_row(self, y, surface):
+        row = material(self.simulation.grid[y])
         non_air_indices = np.where(row != Air.id)[0]
 
-        async def draw_particle(x):
+        for x in non_air_indices:
             material_id = row[x]
             color = self.colors[material_id]
             pygame.draw.rect(
@@ -64,5 +99,3 @@ class Renderer:
                     self.pixel_size,
                 ),
             )
-
-        await asyncio.gather(*[draw_particle(x) for x in non_air_indices])
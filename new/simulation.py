@@ -1,59 +1,321 @@
 import numpy as np
-from materials import get_material, Air
-import asyncio
+from materials import get_material, MATERIALS, TALLY, REACTION_TALLY
+from cell import MATERIAL, FLAGS_SHIFT, STATE, empty, material
+from metrics import Metrics
+from chunks import ChunkTracker
+from occupancy import Occupancy, row_bands
+from world import PagedWorld
+from frame_random import FrameRandom
+from brush import stamp
+from snapshot import save_grid, load_grid
+from vectorized import step_grid, settle, fall, slide, flowing, flow, evaporate
+
+# "cell" calls Material.step for every particle, "vectorized" steps the
+# whole grid at once with array operations, "margolus" does the same one
+# 2x2 block at a time so every block is independent of the others, and
+# "tiled" splits the margolus engine across worker processes
+ENGINES = ("cell", "vectorized", "margolus", "tiled")
 
 
 class Simulation:
-    def __init__(self, width, height):
+    def __init__(
+        self,
+        width,
+        height,
+        engine="cell",
+        seed=None,
+        workers=None,
+        track_chunks=True,
+        world=None,
+        in_place=False,
+    ):
+        # world is a file to keep the grid in, for grids too big for memory.
+        # in_place has the cell engine update the grid directly instead of a
+        # copy of it, with stamps in the cells keeping particles from moving
+        # twice.
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        if world is not None and not (engine == "cell" and track_chunks):
+            raise ValueError("Paged worlds need the cell engine with chunk tracking")
+        if in_place and engine != "cell":
+            raise ValueError("Only the cell engine can step in place")
         self.width = width
         self.height = height
-        self.grid = np.full((height, width), Air.id, dtype=np.int8)
+        self.engine = engine
+        self.in_place = in_place
+        self.rng = np.random.default_rng(seed)
+        self.tick = 0
+        self.metrics = Metrics()
+        # Per-cell engine state kept from one step to the next, see _step_cells
+        self.rand = None
+        # Lets the per-cell engine skip chunks where nothing has moved lately
+        self.chunks = (
+            ChunkTracker(width, height) if engine == "cell" and track_chunks else None
+        )
+        if engine == "tiled":
+            from tiled import TiledEngine
+
+            self.tiles = TiledEngine(width, height, seed, workers)
+            # The grid lives in shared memory and is stepped in place
+            self.grid = self.tiles.grid
+        elif world is not None:
+            # There is no single grid, only the windows of the world that
+            # are in memory, and nothing is until something wakes up
+            self.world = PagedWorld(world, width, height)
+            self.grid = None
+            self.occupancy = None
+            self.chunks.sleep_all()
+            return
+        else:
+            self.grid = empty((height, width))
+        self.world = None
+        self.occupancy = Occupancy(self.grid)
+
+    def reindex(self):
+        # Call after writing to grid directly instead of through paint
+        if self.world:
+            for window in self.world.windows:
+                window.occupancy.rebuild(window.grid)
+                y0, y1, x0, x1 = window.bounds
+                self.chunks.wake(x0, y0, x1 - 1, y1 - 1)
+            return
+        self.occupancy.rebuild(self.grid)
+        if self.chunks:
+            self.chunks.wake_all()
+
+    def population(self, material=None):
+        # Cells holding material, or every non-Air cell without one
+        if self.world:
+            return self.world.population(None if material is None else material.id)
+        if material is None:
+            return len(self.occupancy)
+        return self.occupancy.count(material.id)
 
     def add_material(self, x, y, material, radius):
-        y_range, x_range = np.ogrid[-radius : radius + 1, -radius : radius + 1]
-        mask = x_range * x_range + y_range * y_range <= radius * radius
-
-        x_coords, y_coords = np.where(mask)
-        x_coords += x - radius
-        y_coords += y - radius
-
-        valid_coords = (
-            (x_coords >= 0)
-            & (x_coords < self.width)
-            & (y_coords >= 0)
-            & (y_coords < self.height)
+        self.paint([(x, y)], material, radius)
+
+    def paint(self, points, material, radius, mode="paint"):
+        # Stamp the brush along a polyline of (x, y) grid samples
+        with self.metrics.phase("brush"):
+            grid, occupancy, y0, x0 = self.grid, self.occupancy, 0, 0
+            if self.world:
+                window = self._cover_stroke(points, radius)
+                if window is None:
+                    return
+                grid, occupancy = window.grid, window.occupancy
+                y0, _, x0, _ = window.bounds
+                points = np.asarray(points).reshape(-1, 2) - (x0, y0)
+            ys, xs, before = stamp(grid, points, material.id, radius, mode)
+            occupancy.update(ys, xs, before, grid[ys, xs])
+            if self.chunks and len(ys):
+                self.chunks.wake(
+                    x0 + xs.min(), y0 + ys.min(), x0 + xs.max(), y0 + ys.max()
+                )
+
+    def _cover_stroke(self, points, radius):
+        # Page in the window under a stroke, None if it misses the world
+        points = np.asarray(points, dtype=np.intp).reshape(-1, 2)
+        x0, y0 = np.maximum(points.min(axis=0) - radius, 0)
+        x1, y1 = np.minimum(
+            points.max(axis=0) + radius + 1, (self.width, self.height)
         )
-        self.grid[y_coords[valid_coords], x_coords[valid_coords]] = material.id
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return self.world.cover(y0, y1, x0, x1)
+
+    def step(self):
+        with self.metrics.phase("step"):
+            self._step()
+        self.tick += 1
+        self._record_tallies()
+
+    def _step(self):
+        if self.engine == "tiled":
+            # Stepped in place, so there is no old grid to compare against
+            counts = self.tiles.step(self.tick)
+            TALLY["cells"] += self.grid.size
+            self.occupancy.rebuild(self.grid, counts)
+            return
+
+        if self.engine == "vectorized":
+            new_grid = step_grid(self.grid, self.rng)
+        elif self.engine == "margolus":
+            new_grid = step_margolus(self.grid, self.rng, self.tick % 2)
+        elif self.world:
+            self._step_world()
+            return
+        else:
+            ys, xs = self._step_cells(self)
+            if self.chunks:
+                self.chunks.update(ys, xs)
+            return
+        # Nothing visits cells one by one, so counting them is all it takes
+        self.occupancy.rebuild(new_grid)
+        self.grid = new_grid
+
+    def _step_cells(self, cells, y0=0, x0=0):
+        # Per-cell engine over cells.grid, whose top left cell is (y0, x0).
+        # Returns (ys, xs) of the cells that changed, in world coordinates.
+        # cells is the simulation itself or a window of its world; either
+        # keeps its own random planes, so steady stepping reuses the same
+        # arrays every tick.
+        grid, occupancy = cells.grid, cells.occupancy
+        ys, xs = occupancy.cells(grid)
+        if self.chunks:
+            # Only cells in chunks that are still awake
+            awake = self.chunks.awake_at(y0 + ys, x0 + xs)
+            ys, xs = ys[awake], xs[awake]
+        if not len(ys):
+            return ys, xs
+        if cells.rand is None:
+            cells.rand = FrameRandom(self.rng, grid.shape)
+        cells.rand.next_tick(row_bands(ys))
+        height, width = grid.shape
+        if self.in_place:
+            step_cells(grid, width, height, (ys, xs), cells.rand, in_place=True)
+            # Nothing moves more than one row in a step
+            ys, xs = occupancy.apply_stamps(grid, row_bands(ys, 1))
+        else:
+            new_grid = step_cells(grid, width, height, (ys, xs), cells.rand)
+            ys, xs = occupancy.apply(grid, new_grid)
+            cells.grid = new_grid
+        return y0 + ys, x0 + xs
+
+    def _step_world(self):
+        # Every window in memory is stepped on its own; chunks only age once
+        # all of them have picked which cells are awake
+        self.world.follow(self.chunks)
+        changes = [
+            self._step_cells(window, window.bounds[0], window.bounds[2])
+            for window in self.world.windows
+        ]
+        self.chunks.age()
+        for ys, xs in changes:
+            self.chunks.mark(ys, xs)
+
+    def _record_tallies(self):
+        # Tiled workers keep their own tallies, which never reach this process
+        metrics = self.metrics
+        for name, n in TALLY.items():
+            metrics.count(name, n)
+            TALLY[name] = 0
+        for material_id, other_id in zip(*np.nonzero(REACTION_TALLY)):
+            name = f"{MATERIALS[material_id].__name__}+{MATERIALS[other_id].__name__}"
+            metrics.count(name, int(REACTION_TALLY[material_id, other_id]))
+        REACTION_TALLY[:] = 0
 
     async def update(self):
-        self.grid = await update_grid(self.grid, self.width, self.height)
+        self.step()
 
+    def save(self, path):
+        # A path ending in .npy writes a raw grid that loads memory-mapped
+        if self.world:
+            raise ValueError("Paged worlds live in their file, close to write it")
+        header = {
+            "engine": self.engine,
+            "tick": self.tick,
+            "rng": self.rng.bit_generator.state,
+        }
+        if self.engine == "tiled":
+            header["seed"] = self.tiles.seed
+        if self.chunks:
+            header["chunks"] = self.chunks.idle.tolist()
+        save_grid(path, self.grid, header)
 
-async def async_range(start=0, end=None, step=1):
-    if end is None:
-        end = start
-        start = 0
-    for i in range(start, end, step):
-        yield i
+    def load(self, path):
+        # Written into the existing grid, which the tiled engine shares
+        if self.world:
+            raise ValueError("Paged worlds are loaded by opening their file")
+        header = load_grid(path, self.grid)
+        self.tick = header["tick"]
+        self.rng.bit_generator.state = header["rng"]
+        if "seed" in header and self.engine == "tiled":
+            self.tiles.seed = header["seed"]
+        if self.chunks and "chunks" in header:
+            # Chunks that were asleep stay asleep, so the same cells are
+            # stepped as in the run that was saved
+            self.chunks.idle[...] = header["chunks"]
+            self.occupancy.rebuild(self.grid)
+        else:
+            self.reindex()
 
+    def close(self):
+        if self.engine == "tiled":
+            self.tiles.close()
+        if self.world:
+            self.world.close()
+
+
+def step_cells(grid, width, height, cells=None, rand=None, in_place=False):
+    # cells are the (ys, xs) to update, bottom row first and left to right
+    # within a row; every non-Air cell when not given. In place grid itself
+    # is updated, stamping the cells written (see materials.remember), and
+    # returned with the stamps still on; otherwise a copy of it.
+    if rand is None:
+        rand = FrameRandom(np.random.default_rng(), grid.shape)
+    if cells is None:
+        cells = Occupancy(grid).cells(grid)
+    ys, xs = cells
+    TALLY["cells"] += len(ys)
+
+    if in_place:
+        # A cell nothing has written to yet still holds what it held before
+        # the tick, so its stamp can be worked out up front. Stamping the
+        # cell being stepped means moves only stamp where a particle goes.
+        before = grid[ys, xs]
+        stamped = (before | ((before & MATERIAL) + 1) << FLAGS_SHIFT).tolist()
+        ids = material(before).tolist()
+        for y, x, cell, material_id in zip(ys.tolist(), xs.tolist(), stamped, ids):
+            if grid[y, x] <= STATE:
+                grid[y, x] = cell
+                get_material(material_id).step(grid, x, y, grid, rand, True)
+        return grid
 
-async def update_grid(grid, width, height):
     new_grid = grid.copy()
+    ids = material(grid[ys, xs]).tolist()
+    for y, x, material_id in zip(ys.tolist(), xs.tolist(), ids):
+        get_material(material_id).step(grid, x, y, new_grid, rand)
 
-    async def process_row(y):
-        # Get non-Air material indices in the row
-        non_air_indices = np.where(grid[y] != Air.id)[0]
+    return new_grid
 
-        # Create tasks for non-Air materials
-        row_tasks = [
-            get_material(grid[y, x]).update(grid, x, y, new_grid)
-            for x in non_air_indices
-        ]
 
-        # Execute all tasks for the row concurrently
-        await asyncio.gather(*row_tasks)
+def step_margolus(grid, rng, offset):
+    grid = grid.copy()
+    resolve_blocks(grid, rng, offset, offset)
+    evaporate(grid, rng)
+    TALLY["cells"] += grid.size
+    TALLY["moves"] += settle(grid)
+    return grid
 
-    row_tasks = [process_row(y) async for y in async_range(height - 1, -1, -1)]
-    await asyncio.gather(*row_tasks)
 
-    return new_grid
+def resolve_blocks(grid, rng, row_offset, col_offset):
+    # Margolus neighbourhood: the grid is cut into 2x2 blocks, shifted by one
+    # cell diagonally on alternate ticks so particles can cross block edges.
+    # A block only ever touches its own four cells, so each rule below
+    # resolves all blocks at once with no write conflicts and no dependence
+    # on traversal order. Leaves MOVED flags on the particles that moved.
+    height, width = grid.shape
+    rows = slice(row_offset, row_offset + (height - row_offset) // 2 * 2)
+    cols = slice(col_offset, col_offset + (width - col_offset) // 2 * 2)
+
+    # Block corners:  a b
+    #                 c d
+    corners = ((0, 0), (0, 1), (1, 0), (1, 1))
+    a, b, c, d = (grid[rows, cols][i::2, j::2] for i, j in corners)
+
+    fall(a, c, rng)
+    fall(b, d, rng)
+    slide(a, d, c, b, True, True)
+    slide(b, c, d, a, True, True)
+
+    flows = flowing(grid, rng)[rows, cols]
+    # Within a block each cell can only flow one way, so gate it on a coin
+    # flip to keep the spread rate in line with the other engines
+    flows &= rng.random(flows.shape) < 0.5
+    fa, fb, fc, fd = (flows[i::2, j::2] for i, j in corners)
+    flow(a, b, fa, fb)
+    flow(c, d, fc, fd)
+
+
+async def update_grid(grid, width, height):
+    return step_cells(grid, width, height)
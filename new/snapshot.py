@@ -0,0 +1,85 @@
+import json
+import struct
+import zlib
+import numpy as np
+from materials import CELL
+from cell import CELL_DTYPE, material
+
+# Grid snapshots. The default format is one file: a magic line, a JSON
+# header, then the grid as zlib-compressed runs (the value of every run
+# followed by its length). Grids of settled material are mostly long runs of
+# the same cell, so this is a small fraction of the raw size. For huge grids
+# a plain .npy file can be written instead and memory-mapped on load, with
+# the header next to it as .npy.json.
+
+MAGIC = b"SIMIAN-GRID 2\n"
+# Snapshots from before packed cells, holding bare int8 material ids
+MAGIC_IDS = b"SIMIAN-GRID 1\n"
+
+
+def encode_runs(grid):
+    flat = grid.ravel()
+    starts = np.flatnonzero(np.concatenate(([True], flat[1:] != flat[:-1])))
+    lengths = np.diff(np.append(starts, flat.size)).astype(np.uint32)
+    return flat[starts].astype(CELL_DTYPE), lengths
+
+
+def decode_runs(values, lengths, out):
+    # Writes straight into out, which may be shared memory
+    out.ravel()[:] = np.repeat(values, lengths)
+
+
+def save_grid(path, grid, header):
+    header = dict(header, shape=list(grid.shape))
+    if path.endswith(".npy"):
+        np.save(path, grid)
+        with open(path + ".json", "w") as f:
+            json.dump(header, f)
+        return
+
+    values, lengths = encode_runs(grid)
+    header["runs"] = len(values)
+    meta = json.dumps(header).encode()
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(meta)))
+        f.write(meta)
+        f.write(zlib.compress(values.tobytes() + lengths.tobytes()))
+
+
+def load_grid(path, out):
+    # Fills out with the saved grid and returns the header
+    if path.endswith(".npy"):
+        with open(path + ".json") as f:
+            header = json.load(f)
+        _check_shape(header, out)
+        grid = np.load(path, mmap_mode="r")
+        out[...] = CELL[grid] if grid.dtype == np.int8 else material(grid)
+        return header
+
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic not in (MAGIC, MAGIC_IDS):
+            raise ValueError(f"{path} is not a grid snapshot")
+        (size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(size))
+        _check_shape(header, out)
+        data = zlib.decompress(f.read())
+    runs = header["runs"]
+    dtype = np.dtype(CELL_DTYPE if magic == MAGIC else np.int8)
+    values = np.frombuffer(data, dtype=dtype, count=runs)
+    lengths = np.frombuffer(
+        data, dtype=np.uint32, count=runs, offset=runs * dtype.itemsize
+    )
+    # Cells only keep their material between steps; early version 2 files
+    # also had a temperature in them
+    values = CELL[values] if magic == MAGIC_IDS else material(values)
+    decode_runs(values, lengths, out)
+    return header
+
+
+def _check_shape(header, out):
+    if tuple(header["shape"]) != out.shape:
+        raise ValueError(
+            f"Snapshot grid is {tuple(header['shape'])}, simulation is {out.shape}"
+        )
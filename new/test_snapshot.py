@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from simulation import Simulation
+from materials import CELL, Stone, Water
+
+
+def pool(**kwargs):
+    simulation = Simulation(32, 128, seed=3, **kwargs)
+    simulation.grid[120:] = CELL[Stone.id]
+    simulation.grid[10:40, 8:24] = CELL[Water.id]
+    simulation.reindex()
+    return simulation
+
+
+@pytest.mark.parametrize("suffix", [".sim", ".npy"])
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"engine": "cell"},
+        {"engine": "cell", "in_place": True},
+        {"engine": "vectorized"},
+        {"engine": "margolus"},
+    ],
+)
+def test_loaded_run_continues_like_the_saved_one(tmp_path, suffix, options):
+    # Part of the pool has settled by the save, so some chunks are asleep
+    saved = pool(**options)
+    for _ in range(40):
+        saved.step()
+    path = str(tmp_path / f"pool{suffix}")
+    saved.save(path)
+
+    loaded = Simulation(32, 128, **options)
+    loaded.load(path)
+    for _ in range(30):
+        saved.step()
+        loaded.step()
+    assert loaded.tick == saved.tick
+    assert np.array_equal(loaded.grid, saved.grid)
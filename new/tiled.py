@@ -0,0 +1,94 @@
+import os
+import weakref
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from simulation import resolve_blocks
+from vectorized import evaporate, settle
+from materials import N_MATERIALS
+from cell import CELL_DTYPE, material
+
+# Multi-process Margolus engine. The grid lives in shared memory and is cut
+# into horizontal tiles of whole block rows. Blocks never straddle a tile
+# edge, so every tile of a tick can be stepped by a different worker with no
+# locking; the alternating block offset moves the tile edges by one row each
+# tick, which is what carries material across them (the one-cell halo is
+# reconciled by the next tick's tiling rather than by copying). Each tile
+# draws from its own generator seeded by (seed, tick, tile), so the result
+# only depends on the seed, never on how many workers there are.
+
+TILE_ROWS = 64
+
+# Set in each worker process by _attach
+_shared = None
+_grid = None
+
+
+def _attach(name, shape):
+    global _shared, _grid
+    _shared = shared_memory.SharedMemory(name=name)
+    _grid = np.ndarray(shape, dtype=CELL_DTYPE, buffer=_shared.buf)
+
+
+def _step_tile(start, end, offset, seed, tick, tile):
+    rng = np.random.default_rng([seed, tick, tile])
+    grid = _grid[start:end]
+    # The first tile starts at row 0 even when the blocks are shifted down
+    resolve_blocks(grid, rng, offset if start == 0 else 0, offset)
+    if start == 0:
+        evaporate(grid, rng)
+    settle(grid)
+    # The tile's population, so the main process doesn't have to count
+    return np.bincount(material(grid.ravel()), minlength=N_MATERIALS)
+
+
+class TiledEngine:
+    def __init__(self, width, height, seed=None, workers=None, tile_rows=TILE_ROWS):
+        if tile_rows % 2:
+            raise ValueError("tile_rows must be even to hold whole blocks")
+        self.width = width
+        self.height = height
+        self.tile_rows = tile_rows
+        # The per-tile generators need a concrete seed to stay reproducible
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+        self.seed = seed
+        self.workers = workers or os.cpu_count()
+
+        shape = (height, width)
+        size = height * width * np.dtype(CELL_DTYPE).itemsize
+        self._shared = shared_memory.SharedMemory(create=True, size=size)
+        self.grid = np.ndarray(shape, dtype=CELL_DTYPE, buffer=self._shared.buf)
+        self.grid[:] = 0
+        self._pool = ProcessPoolExecutor(
+            self.workers, initializer=_attach, initargs=(self._shared.name, shape)
+        )
+        self._finalizer = weakref.finalize(
+            self, TiledEngine._release, self._pool, self._shared
+        )
+
+    def tiles(self, offset):
+        # Row ranges of the tiles for a tick, cut on block boundaries
+        edges = list(range(offset + self.tile_rows, self.height, self.tile_rows))
+        starts = [0] + edges
+        ends = edges + [self.height]
+        return list(zip(starts, ends))
+
+    def step(self, tick):
+        offset = tick % 2
+        futures = [
+            self._pool.submit(_step_tile, start, end, offset, self.seed, tick, tile)
+            for tile, (start, end) in enumerate(self.tiles(offset))
+        ]
+        # Every tile has to finish before the next tick shifts the edges.
+        # Returns the population of the grid.
+        return sum(future.result() for future in futures)
+
+    def close(self):
+        self._finalizer()
+
+    @staticmethod
+    def _release(pool, shared):
+        pool.shutdown()
+        # The mapping itself goes away with the last array viewing it
+        shared.unlink()
@@ -0,0 +1,68 @@
+import time
+
+
+class FixedTimestep:
+    # Accumulates real time and hands it out as whole simulation steps of a
+    # fixed length, so the simulation runs at sim_rate no matter how fast
+    # frames are drawn. Renders are only due every 1 / render_rate seconds;
+    # when stepping falls behind, the loop keeps stepping and simply renders
+    # less often. Lag beyond max_lag seconds is dropped instead of caught up.
+    def __init__(self, sim_rate=60, render_rate=60, max_lag=0.25):
+        self.step_dt = 1 / sim_rate
+        self.render_dt = 1 / render_rate
+        self.sim_rate = sim_rate
+        self.render_rate = render_rate
+        self.max_lag = max_lag
+        self.accumulator = 0.0
+        self.last_time = time.perf_counter()
+        self.last_render = self.last_time - self.render_dt
+
+        # Achieved rates, recounted once per second
+        self.steps = 0
+        self.renders = 0
+        self.window_start = self.last_time
+        self.achieved_sim_rate = 0.0
+        self.achieved_render_rate = 0.0
+
+    def advance(self):
+        # Number of fixed steps due since the last call
+        now = time.perf_counter()
+        self.accumulator += min(now - self.last_time, self.max_lag)
+        self.last_time = now
+        steps = int(self.accumulator / self.step_dt)
+        self.accumulator -= steps * self.step_dt
+        self.steps += steps
+        self._update_rates(now)
+        return steps
+
+    def render_due(self):
+        now = time.perf_counter()
+        if now - self.last_render < self.render_dt:
+            return False
+        self.last_render = now
+        self.renders += 1
+        return True
+
+    def wait(self):
+        # Sleep until the next step or render is due
+        now = time.perf_counter()
+        next_step = self.last_time + self.step_dt - self.accumulator
+        next_render = self.last_render + self.render_dt
+        delay = min(next_step, next_render) - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def overlay_text(self):
+        return (
+            f"sim {self.achieved_sim_rate:.0f}/{self.sim_rate} Hz  "
+            f"render {self.achieved_render_rate:.0f}/{self.render_rate} fps"
+        )
+
+    def _update_rates(self, now):
+        elapsed = now - self.window_start
+        if elapsed >= 1.0:
+            self.achieved_sim_rate = self.steps / elapsed
+            self.achieved_render_rate = self.renders / elapsed
+            self.steps = 0
+            self.renders = 0
+            self.window_start = now
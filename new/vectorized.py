@@ -0,0 +1,195 @@
+import numpy as np
+from materials import (
+    DENSITY,
+    VISCOSITY,
+    IS_FLUID,
+    SINKS,
+    DIRECTION,
+    REACTION_PROBABILITY,
+    REACTION_TARGET,
+    REACTION_SOURCE,
+    TALLY,
+    REACTION_TALLY,
+    CELL,
+    Air,
+    Steam,
+    Water,
+)
+from cell import MOVED, STATE, material
+
+# Whole-grid step engine. Instead of calling Material.step once per cell,
+# every rule is applied to all cells at once as NumPy array operations. Each
+# rule works on two equally shaped views of the grid (e.g. every cell and the
+# one below it) that must not overlap, so all the pairs it touches can be
+# resolved independently. step_grid covers the grid with sub-passes over
+# even rows, then odd rows, etc.; other schedulers can pair cells differently.
+# Cells are swapped whole, so whatever is packed into them moves along; the
+# rules themselves look at material ids, and Air cells are exactly Air.id.
+# Particles that already moved or reacted this step carry the MOVED flag,
+# which settle clears once the step is done.
+
+
+def step_grid(grid, rng):
+    grid = grid.copy()
+    height, width = grid.shape
+
+    for parity in (0, 1):
+        top = slice(parity, height - 1, 2)
+        bottom = slice(parity + 1, height, 2)
+        fall(grid[top], grid[bottom], rng)
+
+    # Each particle picks the diagonal it tries first, then the other one
+    first = rng.random(grid.shape) < 0.5
+    for attempt in (0, 1):
+        for parity in (0, 1):
+            rows_top = slice(parity, height - 1, 2)
+            rows_bottom = slice(parity + 1, height, 2)
+            for dx in (-1, 1):
+                # dx is the horizontal step going from the top cell down
+                cols_top = slice(0, width - 1) if dx > 0 else slice(1, width)
+                cols_bottom = slice(1, width) if dx > 0 else slice(0, width - 1)
+                top = (rows_top, cols_top)
+                bottom = (rows_bottom, cols_bottom)
+                slide(
+                    grid[top],
+                    grid[bottom],
+                    grid[rows_bottom, cols_top],
+                    grid[rows_top, cols_bottom],
+                    first[top] == ((dx > 0) == (attempt == 0)),
+                    first[bottom] == ((dx < 0) == (attempt == 0)),
+                )
+
+    flows = flowing(grid, rng)
+    to_right = rng.random(grid.shape) < 0.5
+    for parity in (0, 1):
+        left = (slice(None), slice(parity, width - 1, 2))
+        right = (slice(None), slice(parity + 1, width, 2))
+        flow(
+            grid[left],
+            grid[right],
+            flows[left] & to_right[left],
+            flows[right] & ~to_right[right],
+        )
+
+    evaporate(grid, rng)
+    # Every cell is looked at; moves also take in cells that only reacted
+    TALLY["cells"] += grid.size
+    TALLY["moves"] += settle(grid)
+
+    return grid
+
+
+def settle(grid):
+    # Clear the MOVED flags at the end of a step, returning how many there were
+    moved = np.count_nonzero(grid > STATE)
+    np.bitwise_and(grid, STATE, out=grid)
+    return moved
+
+
+def mark(cells, cond):
+    # Flag whatever particle cells hold as moved where cond holds
+    cells |= (cond & (cells != Air.id)) * MOVED
+
+
+def swap(a, b, cond):
+    # Swap the cells of two views where cond holds and mark whatever particle
+    # ended up in each cell as moved
+    diff = np.where(cond, a ^ b, 0)
+    a ^= diff
+    b ^= diff
+    mark(a, cond)
+    mark(b, cond)
+
+
+def react(source, target, candidates, rng):
+    # Resolve every candidate contact pair with a single table lookup
+    pair = material(source), material(target)
+    reacted = candidates & (rng.random(source.shape) < REACTION_PROBABILITY[pair])
+    if reacted.any():
+        np.add.at(REACTION_TALLY, (pair[0][reacted], pair[1][reacted]), 1)
+        # Whatever reacts starts over as a fresh cell of what it becomes
+        target[...] = np.where(reacted, CELL[REACTION_TARGET[pair]], target)
+        source[...] = np.where(reacted, CELL[REACTION_SOURCE[pair]], source)
+        mark(source, reacted)
+        mark(target, reacted)
+    return reacted
+
+
+def unmoved(a, b):
+    # Where neither cell holds a particle that moved this step
+    return (a | b) <= STATE
+
+
+def fall(top, bottom, rng):
+    # Falling particle on top hitting something below. Cells that react
+    # drop out before the materials read here would go stale.
+    above, below = material(top), material(bottom)
+    free = unmoved(top, bottom)
+    falls = free & (DIRECTION[above] > 0)
+    falls &= ~react(top, bottom, falls, rng)
+    sink = falls & ((below == Air.id) | SINKS[above, below])
+    swap(top, bottom, sink)
+
+    # Rising particle at the bottom hitting something above
+    above, below = material(top), material(bottom)
+    free = unmoved(top, bottom)
+    rises = free & (DIRECTION[below] < 0)
+    rises &= ~react(bottom, top, rises, rng)
+    rise = rises & (
+        (above == Air.id)
+        | ((DIRECTION[above] >= 0) & (DENSITY[above] > DENSITY[below]))
+    )
+    swap(top, bottom, rise)
+
+
+def slide(top, bottom, below_top, above_bottom, down, up):
+    # bottom is diagonally below top. A falling particle slides down when the
+    # cell straight under it is taken, a rising one slides up when the cell
+    # straight over it is taken; down/up say which particles try this pair.
+    above, below = material(top), material(bottom)
+    free = unmoved(top, bottom)
+    slides = (
+        free
+        & down
+        & (DIRECTION[above] > 0)
+        & (below_top != Air.id)
+        & ((below == Air.id) | SINKS[above, below])
+    )
+    swap(top, bottom, slides)
+
+    free = unmoved(top, bottom)
+    slides = (
+        free
+        & up
+        & (DIRECTION[material(bottom)] < 0)
+        & (above_bottom != Air.id)
+        & (top == Air.id)
+    )
+    swap(top, bottom, slides)
+
+
+def flowing(grid, rng):
+    # Fluids that haven't moved this step flow sideways, less often the more
+    # viscous they are
+    ids = material(grid)
+    return IS_FLUID[ids] & (grid <= STATE) & (rng.random(grid.shape) > VISCOSITY[ids])
+
+
+def flow(left, right, to_right, to_left):
+    # Horizontal neighbours: fluids push into lighter cells beside them
+    free = unmoved(left, right)
+    left_density, right_density = DENSITY[material(left)], DENSITY[material(right)]
+    to_right = free & to_right & (right_density < left_density)
+    to_left = free & to_left & (left_density < right_density)
+    swap(left, right, to_right | to_left)
+
+
+def evaporate(grid, rng):
+    # Steam that reached the top of the grid either condenses or disappears
+    top = grid[0]
+    steam = (material(top) == Steam.id) & (top <= STATE)
+    if not steam.any():
+        return
+    roll = rng.random(top.shape)
+    dies = steam & (roll < 0.5)
+    top[dies] = np.where(roll[dies] < 0.1, CELL[Water.id], Air.id)
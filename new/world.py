@@ -0,0 +1,209 @@
+import mmap
+import os
+import numpy as np
+from materials import Air, N_MATERIALS
+from occupancy import Occupancy
+from cell import CELL_DTYPE, empty, material
+
+# Side of a page, the unit worlds are read from and written back to disk in.
+# A page is a multiple of the chunk size and of the OS page size.
+PAGE_SIZE = 256
+
+
+class Window:
+    # A dense block of pages held in memory and stepped as a grid of its own
+    def __init__(self, bounds, grid):
+        self.bounds = bounds  # (y0, y1, x0, x1) in world cells
+        self.grid = grid
+        self.occupancy = Occupancy(grid)
+        # Per-cell engine state, set up by the simulation stepping it
+        self.rand = None
+
+
+class PagedWorld:
+    # A grid too big to keep in memory, stored in a file and mapped with
+    # mmap the way np.memmap maps it. The file is laid out page by page,
+    # each page a contiguous PAGE_SIZE x PAGE_SIZE block, so a page can be
+    # read, written back and dropped from memory on its own. A new file is
+    # all zeros (Air) and sparse, so disk use also only grows with what is
+    # written.
+    #
+    # Only the pages around awake chunks are held in memory, as windows:
+    # each group of touching pages becomes one dense grid. Windows keep at
+    # least a chunk of margin around every awake chunk, and nothing moves
+    # further than a chunk in one step, so the window edges never get in the
+    # way of material that is actually moving.
+    def __init__(self, path, width, height, page_size=PAGE_SIZE):
+        self.width = width
+        self.height = height
+        self.page_size = page_size
+        self.windows = []
+        shape = (-(-height // page_size), -(-width // page_size), page_size, page_size)
+        size = int(np.prod(shape))
+        nbytes = size * np.dtype(CELL_DTYPE).itemsize
+
+        existed = os.path.exists(path)
+        with open(path, "r+b" if existed else "w+b") as f:
+            if not existed:
+                f.truncate(nbytes)
+            elif os.path.getsize(path) != nbytes:
+                raise ValueError(f"{path} does not hold a {width}x{height} world")
+            self._mmap = mmap.mmap(f.fileno(), nbytes)
+        self.pages = np.ndarray(shape, dtype=CELL_DTYPE, buffer=self._mmap)
+
+        # Population of everything on disk, i.e. outside the windows
+        self.counts = np.zeros(N_MATERIALS, dtype=np.int64)
+        if not existed:
+            self.counts[Air.id] = width * height
+            return
+        for row in range(shape[0]):
+            cells = material(self.pages[row].ravel())
+            self.counts += np.bincount(cells, minlength=N_MATERIALS)
+            self._release(row, 0, shape[1])
+        # Padding past the world edges is Air that never leaves the disk
+        self.counts[Air.id] -= size - width * height
+
+    def population(self, material_id=None):
+        # Cells holding material_id, or every non-Air cell without one
+        counts = self.counts + sum(window.occupancy.counts for window in self.windows)
+        if material_id is None:
+            return int(counts.sum() - counts[Air.id])
+        return int(counts[material_id])
+
+    def cover(self, y0, y1, x0, x1):
+        # The window holding a cell rectangle, paging it in if it has to
+        size = self.page_size
+        rect = self._cells(y0 // size, -(-y1 // size), x0 // size, -(-x1 // size))
+        self.arrange([window.bounds for window in self.windows] + [rect])
+        for window in self.windows:
+            wy0, wy1, wx0, wx1 = window.bounds
+            if wy0 <= y0 and y1 <= wy1 and wx0 <= x0 and x1 <= wx1:
+                return window
+
+    def follow(self, chunks):
+        # Page in the pages within a chunk of any awake chunk of the tracker
+        # and page out the rest
+        size = chunks.size
+        rows, cols = chunks.idle.shape
+        ratio = self.page_size // size
+        needed = np.zeros(self.pages.shape[:2], dtype=bool)
+        for y0, y1, x0, x1 in [window.bounds for window in self.windows]:
+            # Chunks only wake up in a window or a chunk past its edge
+            r0, c0 = max(0, y0 // size - 1), max(0, x0 // size - 1)
+            idle = chunks.idle[r0 : -(-y1 // size) + 1, c0 : -(-x1 // size) + 1]
+            cy, cx = np.nonzero(idle < chunks.sleep_frames)
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    needed[
+                        np.clip(r0 + cy + dy, 0, rows - 1) // ratio,
+                        np.clip(c0 + cx + dx, 0, cols - 1) // ratio,
+                    ] = True
+        self.arrange([self._cells(*group) for group in _groups(needed)])
+
+    def arrange(self, rects):
+        # Make the windows exactly the given page-aligned rectangles, merged
+        # until none overlap
+        rects = _merge(rects)
+        kept = {}
+        for window in self.windows:
+            if window.bounds in rects:
+                kept[window.bounds] = window
+            else:
+                self._write(window)
+        self.windows = [
+            kept.get(rect) or Window(rect, self._read(*rect)) for rect in rects
+        ]
+
+    def close(self):
+        for window in self.windows:
+            self._write(window)
+        self.windows = []
+        self.pages = None
+        self._mmap.close()
+
+    def _cells(self, py0, py1, px0, px1):
+        # Cell rectangle of a page rectangle, clipped to the world
+        size = self.page_size
+        return (
+            int(py0 * size),
+            int(min(py1 * size, self.height)),
+            int(px0 * size),
+            int(min(px1 * size, self.width)),
+        )
+
+    def _read(self, y0, y1, x0, x1):
+        size = self.page_size
+        py0, py1, px0, px1 = y0 // size, -(-y1 // size), x0 // size, -(-x1 // size)
+        block = self.pages[py0:py1, px0:px1].transpose(0, 2, 1, 3)
+        grid = block.reshape((py1 - py0) * size, (px1 - px0) * size)
+        grid = grid[: y1 - y0, : x1 - x0].copy()
+        for row in range(py0, py1):
+            self._release(row, px0, px1)
+        self.counts -= np.bincount(material(grid.ravel()), minlength=N_MATERIALS)
+        return grid
+
+    def _write(self, window):
+        y0, y1, x0, x1 = window.bounds
+        size = self.page_size
+        py0, py1, px0, px1 = y0 // size, -(-y1 // size), x0 // size, -(-x1 // size)
+        # Pages past the world edges are padded with Air
+        block = empty(((py1 - py0) * size, (px1 - px0) * size))
+        block[: y1 - y0, : x1 - x0] = window.grid
+        self.pages[py0:py1, px0:px1] = block.reshape(
+            py1 - py0, size, px1 - px0, size
+        ).transpose(0, 2, 1, 3)
+        for row in range(py0, py1):
+            self._release(row, px0, px1)
+        self.counts += window.occupancy.counts
+
+    def _release(self, row, px0, px1):
+        # Write pages back and drop them from this process's memory
+        page = self.page_size * self.page_size * self.pages.itemsize
+        start = (row * self.pages.shape[1] + px0) * page
+        length = (px1 - px0) * page
+        self._mmap.flush(start, length)
+        self._mmap.madvise(mmap.MADV_DONTNEED, start, length)
+
+
+def _groups(mask):
+    # (r0, r1, c0, c1) bounds of every 8-connected group of True cells
+    todo = set(zip(*np.nonzero(mask)))
+    groups = []
+    while todo:
+        r, c = todo.pop()
+        r0, r1, c0, c1 = r, r + 1, c, c + 1
+        stack = [(r, c)]
+        while stack:
+            r, c = stack.pop()
+            r0, r1, c0, c1 = min(r0, r), max(r1, r + 1), min(c0, c), max(c1, c + 1)
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    neighbour = (r + dr, c + dc)
+                    if neighbour in todo:
+                        todo.remove(neighbour)
+                        stack.append(neighbour)
+        groups.append((r0, r1, c0, c1))
+    return groups
+
+
+def _merge(rects):
+    # Replace overlapping rectangles by their bounding box until none overlap
+    rects = list(dict.fromkeys(rects))
+    i = 0
+    while i < len(rects):
+        a = rects[i]
+        for j in range(i + 1, len(rects)):
+            b = rects[j]
+            if a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]:
+                del rects[j]
+                rects[i] = (
+                    min(a[0], b[0]),
+                    max(a[1], b[1]),
+                    min(a[2], b[2]),
+                    max(a[3], b[3]),
+                )
+                i = 0  # The grown box may now overlap earlier ones
+                break
+        else:
+            i += 1
+    return rects
@@ -0,0 +1,108 @@
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+from simulation import Simulation
+from render import RENDER_PATHS
+
+
+def fire_scene(simulation, fires, total):
+    # Fire scattered through a crowd of wood, sand and water
+    margin = 30
+    others = ("Wood", "Sand", "Water")
+    for i in range(total):
+        name = "Fire" if i < fires else others[i % len(others)]
+        particle = simulation.material_classes[name].create_particle(
+            simulation.space,
+            random.uniform(margin, simulation.width - margin),
+            random.uniform(margin, simulation.height - margin),
+        )
+        simulation.particles.add(particle)
+
+
+def bench_fire(simulation, args):
+    fire_scene(simulation, args.fires, args.particles)
+
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        simulation.spread_fire()
+        times.append(time.perf_counter() - start)
+        simulation.remove_flagged_particles()
+
+    print(f"{args.fires} fire particles in a {args.particles}-particle scene")
+    print(f"spread_fire: {median_ms(times):.2f} ms (median)")
+
+
+def bench_churn(simulation, args):
+    # Flag a slice of the scene for removal every frame and time the
+    # bookkeeping that takes them out again
+    fire_scene(simulation, 0, args.particles)
+
+    times = []
+    for _ in range(args.repeats):
+        everything = [p for ps in simulation.particles.values() for p in ps]
+        for particle in random.sample(everything, args.removals):
+            particle.to_remove = True
+        start = time.perf_counter()
+        simulation.update()
+        times.append(time.perf_counter() - start)
+        fire_scene(simulation, 0, args.removals)
+
+    print(f"{args.removals} removals per frame in a {args.particles}-particle scene")
+    print(f"update: {median_ms(times):.2f} ms (median)")
+
+
+def bench_draw(simulation, args):
+    # A full scene at rest with some of it rotated, the way settled boxes are
+    fire_scene(simulation, args.fires, args.particles)
+    for particle_list in simulation.particles.values():
+        for particle in particle_list:
+            if random.random() < 0.5:
+                particle.body.angle = random.uniform(-3.14, 3.14)
+
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        simulation.draw()
+        times.append(time.perf_counter() - start)
+
+    print(f"{args.particles} particles, {args.fires} of them fire ({args.render_path})")
+    print(f"draw: {median_ms(times):.2f} ms (median)")
+
+
+def median_ms(times):
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pymunk simulator hot spots")
+    parser.add_argument("scenario", choices=["fire", "churn", "draw"])
+    parser.add_argument("--fires", type=int, default=1000)
+    parser.add_argument("--particles", type=int, default=9000)
+    parser.add_argument("--removals", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--size", type=int, default=600)
+    parser.add_argument("--render-path", default="sprites", choices=RENDER_PATHS)
+    args = parser.parse_args()
+
+    random.seed(0)
+    pygame.init()
+    window = pygame.display.set_mode((args.size, args.size))
+    simulation = Simulation(window, args.size, args.size, args.render_path, seed=0)
+
+    if args.scenario == "fire":
+        bench_fire(simulation, args)
+    elif args.scenario == "churn":
+        bench_churn(simulation, args)
+    else:
+        bench_draw(simulation, args)
+
+
+if __name__ == "__main__":
+    main()
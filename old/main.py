@@ -1,6 +1,12 @@
 import pygame
 from simulation import Simulation
 
+RENDER_PATH = "sprites"  # or "batched" to rasterise every particle with NumPy
+SIM_RATE = 60  # Physics steps per second
+RENDER_RATE = 60  # Target frames per second, dropped first when physics is slow
+METRICS_SAMPLE_EVERY = 1  # Record phase timings every Nth frame, 0 to turn off
+METRICS_EXPORT = None  # e.g. "metrics.csv" or "metrics.json", written on quit
+
 
 def main():
     pygame.init()
@@ -13,8 +19,9 @@ def main():
     window.fill((0, 0, 0))
     pygame.display.flip()
 
-    simulation = Simulation(window, width, height)
-    simulation.run()
+    simulation = Simulation(window, width, height, render_path=RENDER_PATH)
+    simulation.metrics.sample_every = METRICS_SAMPLE_EVERY
+    simulation.run(SIM_RATE, RENDER_RATE, METRICS_EXPORT)
 
     pygame.quit()
 
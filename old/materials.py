@@ -1,10 +1,13 @@
 import random
-import time
 from abc import ABC, abstractmethod
 from particle import Particle
 from pymunk import Vec2d, Space  # Add this import
 from typing import Tuple, List
 import pymunk
+import numpy as np
+
+# Shared by every material so a seeded Simulation replays the same way
+rng = random.Random()
 
 
 class Material(ABC):
@@ -38,13 +41,13 @@ class Material(ABC):
     def create_particles(cls, space, x, y, count=10):
         particles = []
         for _ in range(count):
-            px = x + random.randint(-cls.SPREAD, cls.SPREAD) // 2 * 2
-            py = y + random.randint(-cls.SPREAD, cls.SPREAD) // 2 * 2
+            px = x + rng.randint(-cls.SPREAD, cls.SPREAD) // 2 * 2
+            py = y + rng.randint(-cls.SPREAD, cls.SPREAD) // 2 * 2
             particle = cls.create_particle(space, px, py)
             if particle is not None:
                 particle.body.velocity = (
-                    random.randint(-cls.VELOCITY_SPREAD, cls.VELOCITY_SPREAD) // 2 * 2,
-                    random.randint(-cls.VELOCITY_SPREAD, cls.VELOCITY_SPREAD) // 2 * 2,
+                    rng.randint(-cls.VELOCITY_SPREAD, cls.VELOCITY_SPREAD) // 2 * 2,
+                    rng.randint(-cls.VELOCITY_SPREAD, cls.VELOCITY_SPREAD) // 2 * 2,
                 )
                 particles.append(particle)
         return particles
@@ -54,6 +57,13 @@ class Material(ABC):
     def update_particle(cls, particle, dt, gravity: Tuple[float, float]):
         pass
 
+    @classmethod
+    def update_slots(cls, store, slots):
+        # Vectorized update over the store's columns for all of this
+        # material's particles at once. Returns a mask of the slots to
+        # remove, or None to fall back to update_particle per particle.
+        return None
+
     @classmethod
     @abstractmethod
     def handle_collision(
@@ -67,13 +77,13 @@ class Fluid(Material):
     def create_particles(cls, space, x, y):
         particles = []
         for _ in range(10):
-            px = x + random.uniform(-5, 5)
-            py = y + random.uniform(-5, 5)
+            px = x + rng.uniform(-5, 5)
+            py = y + rng.uniform(-5, 5)
             particle = cls.create_particle(space, px, py)
             if particle is not None:  # Add this check
                 particle.body.velocity = (
-                    random.uniform(-50, 50),
-                    random.uniform(-50, 50),
+                    rng.uniform(-50, 50),
+                    rng.uniform(-50, 50),
                 )
                 particles.append(particle)
         return particles
@@ -148,9 +158,9 @@ class Fire(Fluid):
     @classmethod
     def create_particle(cls, space, x, y):
         particle = super().create_particle(space, x, y)
-        particle.lifetime = random.uniform(1, 2)
+        particle.lifetime = rng.uniform(1, 2)
         particle.body.velocity = Vec2d(
-            random.uniform(-50, 50), random.uniform(-100, -50)
+            rng.uniform(-50, 50), rng.uniform(-100, -50)
         )
         particle.body.velocity_func = cls.update_velocity
         return particle
@@ -164,17 +174,19 @@ class Fire(Fluid):
         body.velocity += net_force * dt
 
         # Add some random horizontal movement
-        body.velocity += Vec2d(random.uniform(-10, 10), 0) * dt
+        body.velocity += Vec2d(rng.uniform(-10, 10), 0) * dt
 
     @classmethod
-    def update_particle(cls, particle, dt, gravity):
-        age = time.time() - particle.creation_time
-        if age > particle.lifetime:
-            return False  # This signals that the particle should be removed
+    def update_slots(cls, store, slots):
+        remaining = 1 - store.age[slots] / store.lifetime[slots]
 
         # Update color to fade to red
-        particle.color = (255, int(255 * (1 - age / particle.lifetime)), 0)
-        return True  # This signals that the particle should be kept
+        store.color[slots, 1] = 255 * remaining.clip(0, 1)
+        return remaining < 0  # Past its lifetime
+
+    @classmethod
+    def update_particle(cls, particle, dt, gravity):
+        return not cls.update_slots(particle.store, np.array([particle.slot]))[0]
 
     @classmethod
     def handle_collision(
@@ -195,26 +207,27 @@ class Steam(Fluid):
     @classmethod
     def create_particle(cls, space, x, y):
         particle = super().create_particle(space, x, y)
-        particle.lifetime = random.uniform(1, 3)
+        particle.lifetime = rng.uniform(1, 3)
         particle.body.velocity_func = cls.update_velocity
         return particle
 
     @staticmethod
     def update_velocity(body, gravity, damping, dt):
         # Add jittery motion to steam
-        jitter = Vec2d(body.velocity.x + random.uniform(-2, 2), -20)
+        jitter = Vec2d(body.velocity.x + rng.uniform(-2, 2), -20)
         body.velocity = jitter - gravity * dt  # Counteract gravity
 
     @classmethod
-    def update_particle(cls, particle, dt, gravity):
-        age = time.time() - particle.creation_time
-        if age > particle.lifetime:
-            return False
+    def update_slots(cls, store, slots):
+        remaining = 1 - store.age[slots] / store.lifetime[slots]
 
         # Update color to fade to transparent
-        alpha = int(200 * (1 - age / particle.lifetime))
-        particle.color = (*particle.color[:3], alpha)
-        return True
+        store.color[slots, 3] = 200 * remaining.clip(0, 1)
+        return remaining < 0
+
+    @classmethod
+    def update_particle(cls, particle, dt, gravity):
+        return not cls.update_slots(particle.store, np.array([particle.slot]))[0]
 
     @classmethod
     def handle_collision(
@@ -389,7 +402,7 @@ class Wood(Paint):
     ) -> List[Particle]:
         if (
             other_particle.material == Fire or other_particle.material == Lava
-        ) and random.random() < 0.2:  # 20% chance to ignite
+        ) and rng.random() < 0.2:  # 20% chance to ignite
             particle.to_remove = True
             return [
                 Fire.create_particle(
@@ -429,7 +442,7 @@ class Glass(Paint):
         cls, space: Space, particle: Particle, other_particle: Particle
     ) -> List[Particle]:
         if (
-            other_particle.material == Lava and random.random() < 0.1
+            other_particle.material == Lava and rng.random() < 0.1
         ):  # 10% chance to turn into lava
             particle.to_remove = True
             return [
@@ -472,3 +485,17 @@ class Acid(Fluid):
                 )
             ]
         return []
+
+
+# Materials each material reacts with in its handle_collision. The simulation
+# only installs collision handlers for the collision types these pairs cover.
+REACTIONS = {
+    Water: (Fire, Lava),
+    Fire: (Water,),
+    Gravel: (Fire, Acid),
+    Sand: (Fire, Lava, Acid),
+    Lava: (Water,),
+    Wood: (Fire, Lava, Acid),
+    Glass: (Lava,),
+    Acid: (Water, Fire, Lava),
+}
@@ -0,0 +1,111 @@
+import csv
+import json
+import time
+from collections import deque
+from contextlib import nullcontext
+
+# Shared by every phase that isn't being recorded
+_SKIP = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        times = self.metrics.times
+        times[self.name] = times.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+class Metrics:
+    # Always-on per-frame phase timers and counters. The main loop brackets a
+    # frame with begin_frame/end_frame, code in between times itself with
+    # `with metrics.phase(name):` and bumps counters with count(). Phases and
+    # counters entered several times in a frame add up. Only every
+    # sample_every-th frame is recorded (0 records nothing); on the other
+    # frames phase() hands back a shared no-op context and count() returns
+    # straight away. Recorded frames go into a ring buffer of the last
+    # capacity frames.
+    def __init__(self, capacity=600, sample_every=1):
+        self.sample_every = sample_every
+        self.history = deque(maxlen=capacity)
+        self.frame = 0
+        self.sampling = False
+        self.times = {}
+        self.counts = {}
+        self._timers = {}
+
+    def begin_frame(self):
+        self.sampling = bool(self.sample_every) and self.frame % self.sample_every == 0
+        self.times = {}
+        self.counts = {}
+
+    def end_frame(self):
+        if self.sampling:
+            self.history.append((self.frame, self.times, self.counts))
+        self.sampling = False
+        self.frame += 1
+
+    def phase(self, name):
+        if not self.sampling:
+            return _SKIP
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = _Timer(self, name)
+        return timer
+
+    def count(self, name, n=1):
+        if self.sampling:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def summary(self):
+        # Mean milliseconds per phase and mean count per recorded frame
+        frames = len(self.history)
+        times = {}
+        counts = {}
+        for _, frame_times, frame_counts in self.history:
+            for name, seconds in frame_times.items():
+                times[name] = times.get(name, 0.0) + seconds
+            for name, n in frame_counts.items():
+                counts[name] = counts.get(name, 0) + n
+        return (
+            {name: total * 1000 / frames for name, total in times.items()},
+            {name: total / frames for name, total in counts.items()},
+        )
+
+    def overlay_lines(self):
+        if not self.history:
+            return []
+        times, counts = self.summary()
+        lines = [f"{name} {ms:.2f} ms" for name, ms in times.items()]
+        lines += [f"{name} {n:.0f}" for name, n in sorted(counts.items())]
+        return lines
+
+    def rows(self):
+        # One flat dict per recorded frame, phases in milliseconds
+        for frame, times, counts in self.history:
+            row = {"frame": frame}
+            row.update(
+                (f"{name}_ms", seconds * 1000) for name, seconds in times.items()
+            )
+            row.update(counts)
+            yield row
+
+    def export(self, path):
+        # A .json path writes a list of frames, anything else CSV
+        rows = list(self.rows())
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(rows, f, indent=1)
+            return
+        columns = list(dict.fromkeys(name for row in rows for name in row))
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, columns, restval=0)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -1,7 +1,13 @@
 import pygame
 import pymunk
-import time
 import math
+from collections import OrderedDict
+
+ANGLE_BUCKETS = 72  # Rotations are drawn in 5 degree steps
+ANGLE_STEP = 360 / ANGLE_BUCKETS
+SPRITE_CACHE_SIZE = 4096
+_sprites = OrderedDict()
+FLAG_TO_REMOVE = 1  # Bit in ParticleStore.flags
 
 
 class Particle:
@@ -28,33 +34,118 @@ class Particle:
         self.shape.elasticity = elasticity
         self.shape.friction = friction
         self.shape.collision_type = collision_type
-        self.color = color
-        self.creation_time = time.time()
-        self.lifetime = lifetime
         self.body.particle = self
         self.material = material
-        self.to_remove = False
+        self.index = None  # Position in its ParticleStore list
+        self.removed = False
+        # Until the particle is added to a ParticleStore its colour, lifetime
+        # and removal flag are kept here; afterwards they live in the
+        # store's columns at its slot
+        self.store = None
+        self.slot = None
+        self._color = color
+        self._lifetime = lifetime
+        self._to_remove = False
         space.add(self.body, self.shape)
 
+    def attach(self, store, slot):
+        self.store = store
+        self.slot = slot
+        store.set_color(slot, self._color)
+        store.lifetime[slot] = math.inf if self._lifetime is None else self._lifetime
+        if self._to_remove:
+            store.flags[slot] |= FLAG_TO_REMOVE
+
+    def detach(self):
+        # Keeps the last known state for anything still holding the particle
+        slot = self.slot
+        self._color = self.color
+        self._lifetime = self.lifetime
+        self._to_remove = self.to_remove
+        self.store = None
+        self.slot = None
+        return slot
+
+    @property
+    def color(self):
+        if self.store is None:
+            return self._color
+        return tuple(self.store.color[self.slot].tolist())
+
+    @color.setter
+    def color(self, value):
+        if self.store is None:
+            self._color = value
+        else:
+            self.store.set_color(self.slot, value)
+
+    @property
+    def lifetime(self):
+        if self.store is None:
+            return self._lifetime
+        return float(self.store.lifetime[self.slot])
+
+    @lifetime.setter
+    def lifetime(self, value):
+        if self.store is None:
+            self._lifetime = value
+        else:
+            self.store.lifetime[self.slot] = math.inf if value is None else value
+
+    @property
+    def age(self):
+        if self.store is None:
+            return 0.0
+        return float(self.store.age[self.slot])
+
+    @property
+    def to_remove(self):
+        if self.store is None:
+            return self._to_remove
+        return bool(self.store.flags[self.slot] & FLAG_TO_REMOVE)
+
+    @to_remove.setter
+    def to_remove(self, value):
+        if self.store is None:
+            self._to_remove = value
+        elif value:
+            self.store.flags[self.slot] |= FLAG_TO_REMOVE
+        else:
+            self.store.flags[self.slot] &= ~FLAG_TO_REMOVE
+
     def draw(self, window):
         position = self.body.position
-        angle = -self.body.angle  # Pymunk uses opposite rotation direction to Pygame
-
-        # Create a surface for the particle
-        surface = pygame.Surface((int(self.size), int(self.size)), pygame.SRCALPHA)
-        
-        # Draw the particle on the surface
-        if isinstance(self.color, tuple) and len(self.color) == 4:
-            pygame.draw.rect(surface, self.color, (0, 0, int(self.size), int(self.size)))
-        else:
-            pygame.draw.rect(surface, self.color, (0, 0, int(self.size), int(self.size)))
+        size = int(self.size)
+        # Pymunk uses opposite rotation direction to Pygame
+        bucket = round(-math.degrees(self.body.angle) / ANGLE_STEP) % ANGLE_BUCKETS
+
+        # Unrotated opaque squares need no surface at all
+        if bucket == 0 and (len(self.color) == 3 or self.color[3] == 255):
+            window.fill(
+                self.color,
+                (int(position.x - size / 2), int(position.y - size / 2), size, size),
+            )
+            return
+
+        sprite = get_sprite(size, self.color, bucket)
+        rect = sprite.get_rect()
+        blit_pos = (int(position.x - rect.width / 2), int(position.y - rect.height / 2))
+        window.blit(sprite, blit_pos)
 
-        # Rotate the surface
-        rotated_surface = pygame.transform.rotate(surface, math.degrees(angle))
-        
-        # Get the new rect and calculate the position to blit
-        rot_rect = rotated_surface.get_rect()
-        blit_pos = (int(position.x - rot_rect.width / 2), int(position.y - rot_rect.height / 2))
 
-        # Draw the rotated surface
-        window.blit(rotated_surface, blit_pos)
+def get_sprite(size, color, bucket):
+    # Pre-rendered, rotated square; least recently used sprites are dropped
+    # first, which is mostly the fading colours of Fire and Steam
+    key = (size, color, bucket)
+    sprite = _sprites.get(key)
+    if sprite is not None:
+        _sprites.move_to_end(key)
+        return sprite
+    sprite = pygame.Surface((size, size), pygame.SRCALPHA)
+    sprite.fill(color)
+    if bucket:
+        sprite = pygame.transform.rotate(sprite, bucket * ANGLE_STEP)
+    _sprites[key] = sprite
+    if len(_sprites) > SPRITE_CACHE_SIZE:
+        _sprites.popitem(last=False)
+    return sprite
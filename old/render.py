@@ -0,0 +1,130 @@
+import math
+import numpy as np
+import pygame
+from pymunk import batch
+
+
+# "sprites" blits each particle's cached sprite, "batched" rasterises every
+# particle's rotated box with NumPy and writes the pixels in one go
+RENDER_PATHS = ("sprites", "batched")
+ANGLE_BUCKETS = 72
+ANGLE_STEP = 2 * math.pi / ANGLE_BUCKETS
+BODY_FIELDS = (
+    batch.BodyFields.BODY_ID | batch.BodyFields.POSITION | batch.BodyFields.ANGLE
+)
+
+
+class BatchRenderer:
+    def __init__(self, window, space):
+        self.window = window
+        self.space = space
+        self.buffer = batch.Buffer()
+        self.masks = {}  # Size -> pixel footprints of a box per angle bucket
+
+    def draw(self, particles):
+        slots = particles.slots()
+        if not len(slots):
+            return
+        ids = particles.body_id[slots]
+
+        # Positions and angles of every body in the space in one call, then
+        # matched back to the particles through the body ids
+        self.buffer.clear()
+        batch.get_space_bodies(self.space, BODY_FIELDS, self.buffer)
+        body_ids = np.frombuffer(self.buffer.int_buf(), dtype=np.intp)
+        bodies = np.frombuffer(self.buffer.float_buf()).reshape(-1, 3)
+        order = np.argsort(body_ids)
+        found = order[np.searchsorted(body_ids, ids, sorter=order)]
+
+        data = np.column_stack(
+            (
+                bodies[found],
+                particles.sizes[particles.material[slots]],
+                particles.color[slots],
+            )
+        )
+        # Colours in the window's own pixel format, one per particle
+        mapped = pygame.surfarray.map_array(
+            self.window, data[:, 4:7].astype(np.uint8)
+        )
+
+        pixels = pygame.surfarray.pixels2d(self.window)
+        try:
+            width, height = pixels.shape
+            # Flat view of the window so each pixel is a single index
+            row = pixels.strides[1] // pixels.itemsize
+            flat = np.lib.stride_tricks.as_strided(
+                pixels, shape=((height - 1) * row + width,), strides=(pixels.itemsize,)
+            )
+            for size in np.unique(data[:, 3]):
+                group = np.flatnonzero(data[:, 3] == size)
+                self._draw_boxes(flat, width, height, row, data, mapped, group, size)
+        finally:
+            del pixels, flat  # Unlocks the window
+
+    def _draw_boxes(self, flat, width, height, row, data, mapped, group, size):
+        dx, dy, covered = self._box_masks(size)
+        reach = dx.max()
+        x, y, angle = data[group, 0], data[group, 1], data[group, 2]
+        bucket = np.rint(angle / ANGLE_STEP).astype(np.intp) % ANGLE_BUCKETS
+        cx = np.floor(x).astype(np.intp)
+        cy = np.floor(y).astype(np.intp)
+
+        # Every particle stamps the precomputed footprint of its angle bucket
+        dx, dy, inside = dx[bucket], dy[bucket], covered[bucket]
+        index = (cy * row + cx)[:, None] + dy * row + dx
+        # Only boxes reaching past the window edge need per-pixel clipping
+        edge = (
+            (cx < reach) | (cx >= width - reach) | (cy < reach) | (cy >= height - reach)
+        )
+        if edge.any():
+            px = cx[edge, None] + dx[edge]
+            py = cy[edge, None] + dy[edge]
+            inside[edge] &= (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        particle = np.broadcast_to(group[:, None], inside.shape)[inside]
+        index = index[inside]
+
+        opaque = data[particle, 7] >= 255
+        flat[index[opaque]] = mapped[particle[opaque]]
+        if not opaque.all():
+            # Translucent particles (fading Steam) are blended over what is
+            # already drawn
+            blend = ~opaque
+            index, particle = index[blend], particle[blend]
+            alpha = data[particle, 7:8] / 255
+            rgb = pygame.surfarray.pixels3d(self.window)
+            try:
+                px, py = index % row, index // row
+                rgb[px, py] = rgb[px, py] * (1 - alpha) + data[particle, 4:7] * alpha
+            finally:
+                del rgb
+
+    def _box_masks(self, size):
+        # Pixel offsets covered by a box of this size at each angle bucket,
+        # padded to the same length with a mask of which entries are real
+        masks = self.masks.get(size)
+        if masks is None:
+            reach = math.ceil(size * math.sqrt(2) / 2)
+            span = np.arange(-reach, reach + 1)
+            lx, ly = np.meshgrid(span, span, indexing="ij")
+            lx, ly = lx.ravel(), ly.ravel()
+            angle = np.arange(ANGLE_BUCKETS)[:, None] * ANGLE_STEP
+            cos, sin = np.cos(angle), np.sin(angle)
+            # Rotate each pixel centre back into the box's frame and test
+            # it there
+            cx, cy = lx + 0.5, ly + 0.5
+            half = size / 2
+            inside = (np.abs(cx * cos + cy * sin) < half) & (
+                np.abs(cy * cos - cx * sin) < half
+            )
+            # Move the covered offsets to the front of each row
+            order = np.argsort(~inside, axis=1, kind="stable")
+            length = inside.sum(axis=1).max()
+            order = order[:, :length]
+            masks = (
+                lx[order],
+                ly[order],
+                np.take_along_axis(inside, order, axis=1),
+            )
+            self.masks[size] = masks
+        return masks
@@ -2,8 +2,6 @@ import pygame
 import pymunk
 import pymunk.pygame_util
 import time
-from typing import List, Dict
-from particle import Particle
 from materials import (
     Ball,
     Water,
@@ -16,31 +14,34 @@ from materials import (
     Wood,
     Glass,
     Acid,
+    REACTIONS,
+    rng,
 )  # Add Paint import
 from ui import UI
-import random
+from timestep import FixedTimestep
+from metrics import Metrics
+from spatial import SpatialHash
+from store import ParticleStore
+from render import RENDER_PATHS, BatchRenderer
+import numpy as np
 
 
 class Simulation:
-    def __init__(self, window, width, height):
+    def __init__(self, window, width, height, render_path="sprites", seed=None):
+        if render_path not in RENDER_PATHS:
+            raise ValueError(
+                f"Unknown render path {render_path!r}, expected one of {RENDER_PATHS}"
+            )
         self.window = window
+        # One stream for the simulation and the materials; pymunk itself is
+        # deterministic, so a fixed seed replays the same run
+        self.rng = rng
+        self.rng.seed(seed)
         self.width = width
         self.height = height
         self.space = pymunk.Space()
         self.space.gravity = (0, 980)
         self.draw_options = pymunk.pygame_util.DrawOptions(window)
-        self.particles: Dict[str, List[Particle]] = {
-            "Ball": [],
-            "Water": [],
-            "Fire": [],
-            "Steam": [],
-            "Gravel": [],  # Add Gravel to particles dictionary
-            "Sand": [],  # Add Sand to particles dictionary
-            "Lava": [],  # Add Lava to particles dictionary
-            "Glass": [],  # Add Glass to particles dictionary
-            "Wood": [],  # Add Wood to particles dictionary
-            "Acid": [],  # Add Acid to particles dictionary
-        }
         self.material_classes = {
             "Ball": Ball,
             "Water": Water,
@@ -53,16 +54,24 @@ class Simulation:
             "Wood": Wood,  # Add Wood to material_classes dictionary
             "Acid": Acid,  # Add Acid to material_classes dictionary
         }
+        self.particles = ParticleStore(self.material_classes)
         self.ui = UI(window, width, height, self.space)
         self.create_ui()
         self.create_walls()
+        self.contacts = []  # Reacting pairs queued during space.step
         self.setup_collision_handler()
         self.stream_timer = 0
         self.last_update_time = time.time()
         self.grid_size = 4  # Change grid size to match the smallest particle size
         self.fire_spread_timer = 0
         self.fire_spread_interval = 0.1  # Spread fire every 0.1 seconds
+        self.fire_spread_radius = 20
+        self.spatial_hash = SpatialHash(self.fire_spread_radius)
         self.max_paint_distance = 10  # Maximum distance between paint particles
+        self.render_path = render_path
+        self.batch_renderer = BatchRenderer(window, self.space)
+        self.metrics = Metrics()
+        self.show_metrics = False  # Toggled with F3
 
     def create_walls(self):
         wall_thickness = 20
@@ -99,10 +108,17 @@ class Simulation:
         self.ui.create_buttons(materials)
 
     def setup_collision_handler(self):
-        for i in range(2, 8):  # Update range to include Paint's collision type (7)
-            for j in range(2, 8):
-                handler = self.space.add_collision_handler(i, j)
-                handler.begin = self.handle_collision
+        # Only the collision types that can react need a Python callback;
+        # every other contact stays inside the physics engine
+        type_pairs = set()
+        for material, others in REACTIONS.items():
+            for other in others:
+                type_pairs.add(
+                    tuple(sorted((material.COLLISION_TYPE, other.COLLISION_TYPE)))
+                )
+        for i, j in sorted(type_pairs):
+            handler = self.space.add_collision_handler(i, j)
+            handler.begin = self.handle_collision
 
     def handle_collision(self, arbiter, space, data):
         shape_a, shape_b = arbiter.shapes
@@ -115,78 +131,122 @@ class Simulation:
         ):
             return True
 
-        new_particles = []
-        particles_to_remove = []
-
-        new_particles.extend(
-            particle_a.material.handle_collision(space, particle_a, particle_b)
-        )
-        new_particles.extend(
-            particle_b.material.handle_collision(space, particle_b, particle_a)
-        )
-
-        # Check if particles should be removed
-        if particle_a.body not in space.bodies:
-            particles_to_remove.append(particle_a)
-        if particle_b.body not in space.bodies:
-            particles_to_remove.append(particle_b)
+        # Reactions are resolved after the step, see resolve_reactions
+        self.metrics.count("collisions")
+        self.contacts.append((particle_a, particle_b))
+        return True
 
-        # Remove particles from the simulation's particle lists
-        for particle in particles_to_remove:
-            material_name = particle.material.__name__
-            if material_name in self.particles:
-                self.particles[material_name] = [
-                    p for p in self.particles[material_name] if p != particle
-                ]
+    def resolve_reactions(self):
+        metrics = self.metrics
+        new_particles = []
+        for particle_a, particle_b in self.contacts:
+            reacted = False
+            for particle, other in ((particle_a, particle_b), (particle_b, particle_a)):
+                # A particle that already reacted this step is gone
+                if particle.removed:
+                    continue
+                flagged = particle.to_remove
+                created = particle.material.handle_collision(
+                    self.space, particle, other
+                )
+                new_particles.extend(created)
+                if particle.to_remove:
+                    self.particles.discard(particle)
+                reacted = reacted or bool(created) or particle.to_remove != flagged
+            # Most contacts do nothing; only actual reactions are counted
+            if reacted:
+                metrics.count(
+                    f"{particle_a.material.__name__}+{particle_b.material.__name__}"
+                )
+        self.contacts.clear()
 
         # Add new particles to the simulation
         for new_particle in new_particles:
             material_name = new_particle.material.__name__
             if material_name in self.particles:
-                self.particles[material_name].append(new_particle)
+                self.particles.add(new_particle)
             else:
                 print(f"Warning: Unknown material {material_name}")
 
-        return True
+        self.particles.flush(self.space)
+
+    def step(self, dt=1 / 60.0):
+        with self.metrics.phase("step"):
+            self.space.step(dt)
+        with self.metrics.phase("reactions"):
+            self.resolve_reactions()
 
-    def run(self):
+    def run(self, sim_rate=60, render_rate=60, metrics_export=None):
+        # metrics_export is a .csv or .json path written on quit
+        timestep = FixedTimestep(sim_rate, render_rate)
+        metrics = self.metrics
         running = True
+        metrics.begin_frame()
         while running:
-            events = pygame.event.get()
-            for event in events:
-                if event.type == pygame.QUIT:
-                    running = False
-
-            self.ui.handle_events(events)
-            self.update()
-            self.draw()
-            pygame.display.flip()
-            self.space.step(1 / 60.0)
-
-    def update(self):
+            with metrics.phase("input"):
+                events = pygame.event.get()
+                for event in events:
+                    if event.type == pygame.QUIT:
+                        running = False
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                        self.show_metrics = not self.show_metrics
+
+                self.ui.handle_events(events)
+            for _ in range(timestep.advance()):
+                self.update(timestep.step_dt)
+                self.step(timestep.step_dt)
+
+            if not timestep.render_due():
+                timestep.wait()
+                continue
+
+            with metrics.phase("render"):
+                self.draw()
+                lines = [timestep.overlay_text()]
+                if self.show_metrics:
+                    lines += metrics.overlay_lines()
+                self.ui.draw_rates(lines)
+            with metrics.phase("flip"):
+                pygame.display.flip()
+            # A frame runs from one flip to the next, idle passes included
+            metrics.end_frame()
+            metrics.begin_frame()
+
+        if metrics_export:
+            metrics.export(metrics_export)
+
+    def update(self, dt=None):
+        # Without a fixed dt, advance by the real time since the last update
         current_time = time.time()
-        dt = current_time - self.last_update_time
+        if dt is None:
+            dt = current_time - self.last_update_time
         self.last_update_time = current_time
 
-        self.remove_out_of_bounds_particles()
-        self.remove_flagged_particles()
-        self.update_particles(dt)
-        self.limit_particles()
+        with self.metrics.phase("update"):
+            # These only queue removals; they all happen in the flush below
+            self.remove_out_of_bounds_particles()
+            self.remove_flagged_particles()
+            self.update_particles(dt)
+            self.metrics.count("particles", len(self.particles))
+            self.limit_particles()
 
-        self.fire_spread_timer += dt
-        if self.fire_spread_timer >= self.fire_spread_interval:
-            self.spread_fire()
-            self.fire_spread_timer = 0
+            self.fire_spread_timer += dt
+            if self.fire_spread_timer >= self.fire_spread_interval:
+                self.spread_fire()
+                self.fire_spread_timer = 0
+
+            self.particles.flush(self.space)
 
         if self.ui.stream_active:
-            x, y = self.ui.get_mouse_position()
-            self.create_particles(x, y)
+            with self.metrics.phase("brush"):
+                x, y = self.ui.get_mouse_position()
+                self.create_particles(x, y)
 
     def remove_out_of_bounds_particles(self):
-        for material, particle_list in self.particles.items():
-            self.particles[material] = [
-                p for p in particle_list if self.is_in_bounds(p)
-            ]
+        for particle_list in self.particles.values():
+            for particle in particle_list:
+                if not self.is_in_bounds(particle):
+                    self.particles.discard(particle)
 
     def is_in_bounds(self, particle):
         x, y = particle.body.position
@@ -194,76 +254,78 @@ class Simulation:
 
     def update_particles(self, dt):
         gravity = self.space.gravity
+        self.particles.advance(dt)
         for material_name, particle_list in self.particles.items():
+            if not particle_list:
+                continue
             material_class = self.material_classes[material_name]
-            updated_particles = []
+            slots = self.particles.slots(material_name)
+            expired = material_class.update_slots(self.particles, slots)
+            if expired is not None:
+                self.particles.discard_slots(slots[expired])
+                continue
             for particle in particle_list:
-                if material_class.update_particle(particle, dt, gravity):
-                    updated_particles.append(particle)
-                else:
-                    # Remove the particle from the space
-                    self.space.remove(particle.body, particle.shape)
-            self.particles[material_name] = updated_particles
+                if not material_class.update_particle(particle, dt, gravity):
+                    self.particles.discard(particle)
 
     def limit_particles(self):
-        total_particles = sum(len(particles) for particles in self.particles.values())
-        if total_particles > 10000:
-            remove_count = total_particles - 10000
-            for material, particle_list in self.particles.items():
+        remove_count = len(self.particles) - 10000
+        for particle_list in self.particles.values():
+            for particle in particle_list:
                 if remove_count <= 0:
-                    break
-                if len(particle_list) > remove_count:
-                    for particle in particle_list[:remove_count]:
-                        self.space.remove(particle.body, particle.shape)
-                    self.particles[material] = particle_list[remove_count:]
-                    remove_count = 0
-                else:
-                    remove_count -= len(particle_list)
-                    for particle in particle_list:
-                        self.space.remove(particle.body, particle.shape)
-                    self.particles[material] = []
+                    return
+                if not particle.removed:
+                    self.particles.discard(particle)
+                    remove_count -= 1
 
     def draw(self):
         self.window.fill((0, 0, 0))
-        for particle_list in self.particles.values():
-            for particle in particle_list:
-                particle.draw(self.window)
-        total_particles = sum(len(particles) for particles in self.particles.values())
-        self.ui.draw(total_particles)
+        if self.render_path == "batched":
+            self.batch_renderer.draw(self.particles)
+        else:
+            for particle_list in self.particles.values():
+                for particle in particle_list:
+                    particle.draw(self.window)
+        self.ui.draw(len(self.particles))
 
     def remove_flagged_particles(self):
-        for material, particle_list in self.particles.items():
-            particles_to_remove = [p for p in particle_list if p.to_remove]
-            for particle in particles_to_remove:
-                self.space.remove(particle.body, particle.shape)
-                particle_list.remove(particle)
+        self.particles.discard_slots(self.particles.flagged())
 
     def spread_fire(self):
+        # Bucket every particle once so each fire only checks its neighbours
+        self.spatial_hash.rebuild(
+            particle
+            for particle_list in self.particles.values()
+            for particle in particle_list
+        )
         new_fire_particles = []
         for fire_particle in self.particles["Fire"]:
-            if random.random() < 0.1:  # 10% chance to spread fire
-                nearby_particles = self.find_nearby_particles(fire_particle, 20)
+            if self.rng.random() < 0.1:  # 10% chance to spread fire
+                nearby_particles = self.find_nearby_particles(
+                    fire_particle, self.fire_spread_radius
+                )
                 for nearby_particle in nearby_particles:
-                    if isinstance(nearby_particle.material, Wood):
+                    if (
+                        isinstance(nearby_particle.material, Wood)
+                        and not nearby_particle.removed
+                    ):
                         new_fire = Fire.create_particle(
                             self.space,
                             nearby_particle.body.position.x,
                             nearby_particle.body.position.y,
                         )
                         new_fire_particles.append(new_fire)
-                        nearby_particle.to_remove = True
+                        self.particles.discard(nearby_particle)
 
-        self.particles["Fire"].extend(new_fire_particles)
+        self.particles.extend(new_fire_particles)
 
     def find_nearby_particles(self, particle, radius):
-        nearby = []
-        for material, particle_list in self.particles.items():
-            for other in particle_list:
-                if other != particle:
-                    distance = particle.body.position.get_distance(other.body.position)
-                    if distance <= radius:
-                        nearby.append(other)
-        return nearby
+        # Uses the spatial hash as of its last rebuild
+        return [
+            other
+            for other in self.spatial_hash.query(particle.body.position, radius)
+            if other != particle
+        ]
 
     def create_particles(self, x, y):
         material_class = self.material_classes[self.ui.selected_material]
@@ -282,9 +344,7 @@ class Simulation:
                     )
                     particle.body.position = pymunk.Vec2d(px, py)
 
-            self.particles[self.ui.selected_material].extend(
-                [p for p in new_particles if p is not None]
-            )
+            self.particles.extend([p for p in new_particles if p is not None])
 
     def create_paint_stroke(self, end_x, end_y, material_class):
         if self.ui.last_paint_position is None:
@@ -317,11 +377,11 @@ class Simulation:
             qx, qy = self.quantize_position(x, y)
 
             # Add some randomness to create a more natural-looking stroke
-            qx += random.uniform(-self.grid_size / 2, self.grid_size / 2)
-            qy += random.uniform(-self.grid_size / 2, self.grid_size / 2)
+            qx += self.rng.uniform(-self.grid_size / 2, self.grid_size / 2)
+            qy += self.rng.uniform(-self.grid_size / 2, self.grid_size / 2)
 
             new_particles = material_class.create_particles(self.space, qx, qy, count=1)
-            self.particles[self.ui.selected_material].extend(new_particles)
+            self.particles.extend(new_particles)
 
     def quantize_position(self, x, y):
         # Quantize the position to the nearest grid point
@@ -329,3 +389,52 @@ class Simulation:
             round(x / self.grid_size) * self.grid_size,
             round(y / self.grid_size) * self.grid_size,
         )
+
+    def save(self, path):
+        # One column per field, rows in slot order
+        slots = self.particles.slots()
+        bodies = [self.particles.owners[slot].body for slot in slots.tolist()]
+        position = [tuple(body.position) for body in bodies]
+        velocity = [tuple(body.velocity) for body in bodies]
+        np.savez_compressed(
+            path,
+            materials=np.array(list(self.particles.ids)),
+            material=self.particles.material[slots],
+            position=np.array(position).reshape(-1, 2),
+            velocity=np.array(velocity).reshape(-1, 2),
+            angle=np.array([body.angle for body in bodies]),
+            angular_velocity=np.array([body.angular_velocity for body in bodies]),
+            age=self.particles.age[slots],
+            lifetime=self.particles.lifetime[slots],
+            color=self.particles.color[slots],
+        )
+
+    def load(self, path):
+        # Replaces every particle in the simulation
+        for particle_list in self.particles.values():
+            for particle in particle_list:
+                self.particles.discard(particle)
+        self.particles.flush(self.space)
+
+        with np.load(path) as data:
+            columns = {name: data[name] for name in data.files}
+        classes = [self.material_classes[str(name)] for name in columns["materials"]]
+        rows = zip(
+            columns["material"].tolist(),
+            columns["position"].tolist(),
+            columns["velocity"].tolist(),
+            columns["angle"].tolist(),
+            columns["angular_velocity"].tolist(),
+        )
+        # Bodies still have to be created one at a time
+        slots = []
+        for material_id, (x, y), velocity, angle, angular_velocity in rows:
+            particle = classes[material_id].create_particle(self.space, x, y)
+            particle.body.velocity = velocity
+            particle.body.angle = angle
+            particle.body.angular_velocity = angular_velocity
+            self.particles.add(particle)
+            slots.append(particle.slot)
+        self.particles.age[slots] = columns["age"]
+        self.particles.lifetime[slots] = columns["lifetime"]
+        self.particles.color[slots] = columns["color"]
@@ -0,0 +1,35 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+from particle import Particle
+
+
+class SpatialHash:
+    # Uniform grid of buckets keyed by cell coordinates. A radius query only
+    # looks at the buckets overlapping the query circle instead of every
+    # particle in the simulation.
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.buckets: Dict[Tuple[int, int], List[Particle]] = defaultdict(list)
+
+    def rebuild(self, particles: Iterable[Particle]) -> None:
+        self.buckets.clear()
+        size = self.cell_size
+        for particle in particles:
+            x, y = particle.body.position
+            self.buckets[(int(x // size), int(y // size))].append(particle)
+
+    def query(self, position, radius: float) -> List[Particle]:
+        x, y = position
+        size = self.cell_size
+        radius_squared = radius * radius
+        nearby = []
+        for bx in range(int((x - radius) // size), int((x + radius) // size) + 1):
+            for by in range(int((y - radius) // size), int((y + radius) // size) + 1):
+                bucket = self.buckets.get((bx, by))
+                if not bucket:
+                    continue
+                for other in bucket:
+                    ox, oy = other.body.position
+                    if (ox - x) ** 2 + (oy - y) ** 2 <= radius_squared:
+                        nearby.append(other)
+        return nearby
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+from particle import FLAG_TO_REMOVE, Particle
+
+
+class ParticleStore:
+    # Per-material particle lists where every particle remembers its index
+    # in its list. Removal moves the last particle of the list into the gap
+    # and pops, so it never shifts or rebuilds a list. Removals are queued
+    # with discard() and applied all at once by flush(), which also takes
+    # the bodies out of the space in a single call.
+    #
+    # Per-frame particle state lives in NumPy columns indexed by slot, so
+    # materials can age, fade and expire all of their particles at once.
+    # Free slots have a material id of -1 and are reused by later particles.
+    def __init__(self, materials: Dict[str, type], capacity: int = 1024):
+        self.lists: Dict[str, List[Particle]] = {name: [] for name in materials}
+        self.pending: List[Particle] = []
+        self.count = 0  # Live particles, not counting pending removals
+        self.ids = {name: i for i, name in enumerate(materials)}
+        self.sizes = np.array([material.SIZE for material in materials.values()])
+
+        self.age = np.zeros(capacity)
+        self.lifetime = np.full(capacity, math.inf)
+        self.color = np.zeros((capacity, 4), dtype=np.uint8)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.material = np.full(capacity, -1, dtype=np.int8)
+        self.body_id = np.zeros(capacity, dtype=np.intp)
+        self.owners: List[Optional[Particle]] = [None] * capacity
+        self.free: List[int] = []
+        self.used = 0  # Slots below this have been handed out at least once
+
+    def __getitem__(self, name: str) -> List[Particle]:
+        return self.lists[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.lists
+
+    def __len__(self) -> int:
+        return self.count
+
+    def items(self):
+        return self.lists.items()
+
+    def values(self):
+        return self.lists.values()
+
+    def add(self, particle: Particle) -> None:
+        name = particle.material.__name__
+        particle_list = self.lists[name]
+        particle.index = len(particle_list)
+        particle_list.append(particle)
+        self.count += 1
+
+        slot = self._allocate()
+        self.age[slot] = 0
+        self.flags[slot] = 0
+        self.material[slot] = self.ids[name]
+        self.body_id[slot] = particle.body.id
+        self.owners[slot] = particle
+        particle.attach(self, slot)
+
+    def extend(self, particles: Iterable[Particle]) -> None:
+        for particle in particles:
+            self.add(particle)
+
+    def discard(self, particle: Particle) -> None:
+        if particle.removed:
+            return
+        particle.removed = True
+        self.pending.append(particle)
+        self.count -= 1
+
+    def flush(self, space) -> None:
+        if not self.pending:
+            return
+        objects = []
+        for particle in self.pending:
+            particle_list = self.lists[particle.material.__name__]
+            last = particle_list.pop()
+            if last is not particle:
+                particle_list[particle.index] = last
+                last.index = particle.index
+            particle.index = None
+            slot = particle.detach()
+            self.material[slot] = -1
+            self.owners[slot] = None
+            self.free.append(slot)
+            objects.append(particle.body)
+            objects.append(particle.shape)
+        space.remove(*objects)
+        self.pending.clear()
+
+    def slots(self, name: Optional[str] = None) -> np.ndarray:
+        # Occupied slots, optionally only those of one material
+        material = self.material[: self.used]
+        if name is None:
+            return np.flatnonzero(material >= 0)
+        return np.flatnonzero(material == self.ids[name])
+
+    def flagged(self) -> np.ndarray:
+        # Occupied slots whose particle is marked to_remove
+        used = slice(0, self.used)
+        return np.flatnonzero(
+            (self.flags[used] & FLAG_TO_REMOVE != 0) & (self.material[used] >= 0)
+        )
+
+    def advance(self, dt: float) -> None:
+        self.age[: self.used] += dt
+
+    def discard_slots(self, slots: np.ndarray) -> None:
+        for slot in slots.tolist():
+            self.discard(self.owners[slot])
+
+    def set_color(self, slot: int, color) -> None:
+        self.color[slot, : len(color)] = color
+        if len(color) == 3:
+            self.color[slot, 3] = 255
+
+    def _allocate(self) -> int:
+        if self.free:
+            return self.free.pop()
+        if self.used == len(self.material):
+            self._grow()
+        self.used += 1
+        return self.used - 1
+
+    def _grow(self) -> None:
+        extra = len(self.material)
+        self.age = np.concatenate((self.age, np.zeros(extra)))
+        self.lifetime = np.concatenate((self.lifetime, np.full(extra, math.inf)))
+        self.color = np.concatenate((self.color, np.zeros((extra, 4), np.uint8)))
+        self.flags = np.concatenate((self.flags, np.zeros(extra, np.uint8)))
+        self.material = np.concatenate((self.material, np.full(extra, -1, np.int8)))
+        self.body_id = np.concatenate((self.body_id, np.zeros(extra, np.intp)))
+        self.owners.extend([None] * extra)
@@ -72,5 +72,14 @@ class UI:
         text = font.render(f"Particles: {total_particles}", True, (0, 0, 0))
         self.window.blit(text, (256, 10))
 
+    def draw_rates(self, lines: List[str]) -> None:
+        # Right-aligned, one line under the other
+        font = pygame.font.Font(None, 24)
+        y = 10
+        for text in lines:
+            surface = font.render(text, True, (255, 255, 255))
+            self.window.blit(surface, (self.width - surface.get_width() - 10, y))
+            y += surface.get_height()
+
     def get_mouse_position(self) -> tuple[int, int]:
         return pygame.mouse.get_pos()